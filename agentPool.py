@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, List
+
+if TYPE_CHECKING:
+    from browserAgent import BrowserAgent
+
+_local = threading.local()
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class AgentPool:
+    """A pool of pre-launched BrowserAgents that are checked out per task.
+
+    Playwright's sync API is bound to the thread that started it, so a pool (and
+    every agent in it) must only be used from the thread that created it.
+    """
+
+    def __init__(self,
+                 factory: Callable[[], BrowserAgent],
+                 reset: Callable[[BrowserAgent], None],
+                 min_size: int = 1,
+                 max_size: int = 1):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(
+                f"Invalid pool size: min_size={min_size}, max_size={max_size}")
+        self.factory = factory
+        self.reset = reset
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle: List[BrowserAgent] = []
+        self.busy: List[BrowserAgent] = []
+
+    @property
+    def size(self):
+        return len(self.idle) + len(self.busy)
+
+    def start(self):
+        while self.size < self.min_size:
+            self.idle.append(self.factory())
+        return self
+
+    def acquire(self) -> BrowserAgent:
+        while self.idle:
+            agent = self.idle.pop()
+            if agent.is_healthy():
+                self.busy.append(agent)
+                return agent
+            print("Discarding an unhealthy agent from the pool...")
+            self._discard(agent)
+        if self.size >= self.max_size:
+            raise PoolExhausted(
+                f"All {self.max_size} agents in the pool are in use")
+        agent = self.factory()
+        self.busy.append(agent)
+        return agent
+
+    def release(self, agent: BrowserAgent):
+        self.busy.remove(agent)
+        try:
+            if not agent.is_healthy():
+                raise Exception("Agent is unhealthy")
+            self.reset(agent)
+            self.idle.append(agent)
+        except Exception as e:
+            print(f"Could not return the agent to the pool: {e}")
+            self._discard(agent)
+        # keep the pool warm for the next request
+        try:
+            self.start()
+        except Exception as e:
+            print(f"Could not refill the pool: {e}")
+
+    def owns(self, agent: BrowserAgent) -> bool:
+        return agent in self.busy or agent in self.idle
+
+    @contextmanager
+    def agent(self):
+        agent = self.acquire()
+        try:
+            yield agent
+        finally:
+            self.release(agent)
+
+    def close(self):
+        for agent in self.idle + self.busy:
+            self._discard(agent)
+        self.idle = []
+        self.busy = []
+
+    def _discard(self, agent: BrowserAgent):
+        try:
+            agent.close()
+        except Exception as e:
+            print(f"Error closing agent: {e}")
+
+
+def set_current_pool(pool: AgentPool | None):
+    _local.pool = pool
+
+
+def current_pool() -> AgentPool | None:
+    return getattr(_local, "pool", None)
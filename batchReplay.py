@@ -0,0 +1,226 @@
+import asyncio
+import base64
+import re
+import time
+from typing import Callable, List
+
+from playwright.async_api import BrowserContext, Page, Request, async_playwright
+from playwright.async_api import Error as PlaywrightError
+
+import perception
+from jobs import JobCancelled, raise_if_cancelled
+from browserAgent import (dom_quiet_script, hint_agent_call, hint_agent_script, long_lived_resource_types,
+                          page_clip, ready_timeout, reload_broken_images_script, replay_blocked_urls, vimium_path)
+from screenshot import Screenshot, screenshot_format, screenshot_quality
+from sessionState import local_storage_script
+
+
+async def run_batch(objectives: List[str],
+                    resolve_steps: Callable[[str], List[dict] | None],
+                    home_url: str,
+                    ready_selector: str,
+                    concurrency: int = 4,
+                    headless: bool = False,
+                    session_state: dict | None = None,
+                    save_url_pattern: str | None = None) -> List[dict]:
+    """Replay the playbooks for many objectives at once, each in its own tab of one browser.
+
+    `resolve_steps(objective)` returns the adjusted playbook steps, or None when there is no
+    playbook for the objective or it could not be adjusted. It runs on a worker thread since
+    it may call the model.
+    `session_state` is a saved login (see sessionState.SessionStore) the browser starts with.
+    A tab only closes once no request matching `save_url_pattern` is in flight anymore.
+    """
+    if concurrency < 1:
+        raise ValueError(f"concurrency must be at least 1, got {concurrency}")
+    async with async_playwright() as playwright:
+        # extensions need a persistent context, so every objective gets its own page in a
+        # shared one instead of its own context, the profile itself is a throwaway one
+        context = await playwright.chromium.launch_persistent_context(
+            user_data_dir="",
+            # chromium's new headless mode, the one playwright uses can not load extensions
+            headless=False,
+            args=[
+                f"--disable-extensions-except={vimium_path}",
+                f"--load-extension={vimium_path}",
+                *(["--headless=new"] if headless else []),
+            ],
+            ignore_https_errors=True,
+        )
+        await context.add_init_script(hint_agent_script)
+        if session_state:
+            await context.add_cookies(session_state.get("cookies", []))
+            await context.add_init_script(local_storage_script(session_state))
+        semaphore = asyncio.Semaphore(concurrency)
+        replays = asyncio.gather(*(
+            replay_objective(context, semaphore, objective, resolve_steps, home_url, ready_selector,
+                             save_url_pattern)
+            for objective in objectives))
+        try:
+            # a job is cancelled from another thread, so look between waits
+            while not replays.done():
+                try:
+                    raise_if_cancelled()
+                except JobCancelled:
+                    replays.cancel()
+                    # the tabs close before the browser does
+                    await asyncio.gather(replays, return_exceptions=True)
+                    raise
+                await asyncio.wait([replays], timeout=0.5)
+            return replays.result()
+        finally:
+            await context.close()
+
+
+async def replay_objective(context: BrowserContext,
+                           semaphore: asyncio.Semaphore,
+                           objective: str,
+                           resolve_steps: Callable[[str], List[dict] | None],
+                           home_url: str,
+                           ready_selector: str,
+                           save_url_pattern: str | None = None) -> dict:
+    start = time.perf_counter()
+    timings = {}
+    try:
+        steps = await asyncio.to_thread(resolve_steps, objective)
+        timings["resolve"] = time.perf_counter() - start
+        if steps is None:
+            return {"objective": objective, "status": "failed", "error": "No playbook to replay for this objective",
+                    "timings": timings}
+        async with semaphore:
+            queued = time.perf_counter()
+            page = await context.new_page()
+            requests = track_requests(page)
+            try:
+                # like BrowserAgent.block_resources, recorded selectors need no images or fonts
+                session = await context.new_cdp_session(page)
+                await session.send("Network.enable")
+                await session.send("Network.setBlockedURLs", {"urls": replay_blocked_urls})
+                await page.set_viewport_size({"width": 360, "height": 844})
+                await page.goto(home_url, timeout=60000)
+                await page.wait_for_selector(ready_selector)
+                timings["open"] = time.perf_counter() - queued
+                result = None
+                for action in steps:
+                    if "query_result" in action:
+                        await session.send("Network.setBlockedURLs", {"urls": []})
+                        await page.evaluate(reload_broken_images_script)
+                        # an SPA is idle from the start, a change made by the steps before may still be saving
+                        await wait_for_saves(page, requests, save_url_pattern)
+                        await page.wait_for_load_state("networkidle")
+                        screenshot = await capture(context, page)
+                        action = await asyncio.to_thread(
+                            perception.query_screenshot, screenshot, objective)
+                    result = await perform_action(page, action)
+                # let the app finish saving before the tab goes away, like main.close_driver
+                await wait_for_saves(page, requests, save_url_pattern)
+            finally:
+                await page.close()
+        timings["total"] = time.perf_counter() - start
+        return {"objective": objective, "status": "succeeded", "result": result, "timings": timings}
+    except Exception as e:
+        timings["total"] = time.perf_counter() - start
+        return {"objective": objective, "status": "failed", "error": str(e), "timings": timings}
+
+
+def track_requests(page: Page) -> set[Request]:
+    # the async twin of BrowserAgent.track_requests, for one tab
+    inflight: set[Request] = set()
+
+    def started(request: Request):
+        if request.resource_type not in long_lived_resource_types:
+            inflight.add(request)
+
+    page.on("request", started)
+    page.on("requestfinished", inflight.discard)
+    page.on("requestfailed", inflight.discard)
+    return inflight
+
+
+async def wait_for_saves(page: Page, inflight: set[Request], save_url_pattern: str | None):
+    # todoist sends a change once the UI settled, then keeps the request open until it is saved
+    try:
+        await page.evaluate(dom_quiet_script, {"quietMs": 200, "timeoutMs": ready_timeout})
+    except PlaywrightError:
+        # the page navigated away while we were watching it
+        pass
+    if save_url_pattern:
+        await wait_for_pending_requests(inflight, save_url_pattern)
+
+
+async def wait_for_pending_requests(inflight: set[Request], url_pattern: str, timeout=ready_timeout) -> bool:
+    # the async twin of BrowserAgent.wait_for_pending_requests
+    pattern = re.compile(url_pattern)
+    deadline = time.monotonic() + timeout / 1000
+    while any(pattern.search(request.url) for request in inflight):
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+async def perform_action(page: Page, action: dict):
+    # the async twin of BrowserAgent.perform_action
+    print(f"Performing action: {action}")
+    if "done" in action:
+        return True
+    if "query_result" in action:
+        return action
+    if "click" in action:
+        await click(page, action)
+        if "type" in action:
+            await page.keyboard.type(action["type"])
+    elif "navigate" in action:
+        url = action["navigate"]
+        await page.goto(url if "://" in url else "https://" + url, timeout=60000)
+    elif "type" in action:
+        await page.keyboard.type(action["type"])
+    elif "scroll" in action:
+        await page.keyboard.press("Escape")
+        await page.keyboard.type("d" if action["scroll"] == "down" else "u")
+
+
+async def click(page: Page, action: dict):
+    if "clicked_element" in action:
+        await page.locator(action["clicked_element"]).click()
+        return
+    # steps recorded without a selector still need the vimium hints
+    await page.evaluate('''() => window.postMessage({ type: "ACTIVATE_VIMIUM", text: "Activate_Vimium" }, "*")''')
+    await page.wait_for_selector("#vimiumHintMarkerContainer", state="attached")
+    hints = await call_hint_agent(page, "snapshot") or {}
+    if action["click"] not in hints:
+        raise Exception(f"No hint {action['click']} on the page")
+    await page.evaluate('''() => window.postMessage({ type: "DEACTIVATE_VIMIUM", text: "Deactivate_Vimium" }, "*")''')
+    await page.locator(f"xpath={hints[action['click']]['xpath']}").click(force=True)
+
+
+async def call_hint_agent(page: Page, method: str):
+    # the async twin of BrowserAgent.call_hint_agent
+    result = await page.evaluate(hint_agent_call(method))
+    if result is None:
+        await page.evaluate(f"() => {{ {hint_agent_script} }}")
+        result = await page.evaluate(hint_agent_call(method))
+    return result["value"]
+
+
+async def capture(context: BrowserContext, page: Page) -> Screenshot:
+    # only the main content is read, the same crop BrowserAgent.capture_content takes
+    viewport = page.viewport_size or {"width": 360, "height": 844}
+    scale = perception.IMG_RES / viewport["width"]
+    clip = await call_hint_agent(page, "contentRegion") \
+        or {"x": 0, "y": 0, "width": viewport["width"], "height": viewport["height"]}
+    session = await context.new_cdp_session(page)
+    params = {
+        "format": screenshot_format,
+        "clip": {**page_clip(clip, await session.send("Page.getLayoutMetrics")), "scale": scale},
+    }
+    if screenshot_format != "png":
+        params["quality"] = screenshot_quality
+    result = await session.send("Page.captureScreenshot", params)
+    await session.detach()
+    return Screenshot(
+        base64.b64decode(result["data"]),
+        screenshot_format,
+        round(clip["width"] * scale),
+        round(clip["height"] * scale),
+    )
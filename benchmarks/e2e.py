@@ -0,0 +1,237 @@
+"""End-to-end benchmark that runs without network access.
+
+Runs the agent against the local Todoist stand-in (benchmarks/fixture_site.py) and the
+fake OpenAI server (benchmarks/fake_openai.py) in headless chromium, and reports steps per
+second, task latency, bytes sent to the model per step and memory for each scenario:
+
+    reasoning  do_image_reasoning_work with a pooled browser
+    replay     replay_history of playbooks recorded for similar objectives
+    server     POST /run to the Flask app and poll the job until it finished
+
+    python benchmarks/e2e.py [--scenario all] [--tasks 5] [--latency-ms 800] [--json out.json]
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fake_openai import start_fake_openai  # noqa: E402
+from fixture_site import start_fixture_site  # noqa: E402
+import telemetry  # noqa: E402
+
+items = ["buy milk", "call mom", "renew the passport", "fix the bike", "water the plants",
+         "send the invoice", "book a dentist appointment", "return the library books"]
+
+# what recording "add a task to buy milk" with PWDEBUG=1 produces
+recorded_playbook = [
+    {"click": "A", "clicked_element": 'button[aria-label="Add task"]'},
+    {"click": "B", "type": "buy milk", "clicked_element": 'input[name="content"]'},
+    {"click": "C", "clicked_element": 'button[aria-label="Save task"]'},
+    {"done": True},
+]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def process_tree_rss() -> int:
+    """RSS in bytes of this process and everything it started (chromium), Linux only."""
+    children: dict[int, list[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    total = 0
+    pending = [os.getpid()]
+    while pending:
+        pid = pending.pop()
+        pending.extend(children.get(pid, []))
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            pass
+    return total
+
+
+class Scenario:
+    def __init__(self, name: str, model_stats):
+        self.name = name
+        self.model_stats = model_stats
+        self.latencies: list[float] = []
+        self.failures = 0
+        self.peak_rss = 0
+
+    def __enter__(self):
+        self.steps_before = self.steps()
+        self.model_before = self.model_stats.snapshot()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self.started
+        self.step_count = self.steps() - self.steps_before
+        self.model_after = self.model_stats.snapshot()
+
+    def steps(self) -> float:
+        counter = telemetry.registry.counter("vimbot_steps_total", "Steps taken")
+        return sum(counter.values.values())
+
+    def task(self, run):
+        start = time.perf_counter()
+        steps_before = self.steps()
+        try:
+            run()
+            # a task that finished without doing anything measured nothing
+            if self.steps() == steps_before:
+                raise Exception("The task performed no steps")
+        except Exception as e:
+            print(f"[{self.name}] task failed: {e!r}")
+            self.failures += 1
+        self.latencies.append(time.perf_counter() - start)
+        if sys.platform == "linux":
+            self.peak_rss = max(self.peak_rss, process_tree_rss())
+
+    def report(self) -> dict:
+        def delta(kind, endpoint):
+            return self.model_after[kind].get(endpoint, 0) - self.model_before[kind].get(endpoint, 0)
+        chat_bytes = delta("request_bytes", "chat")
+        return {
+            "scenario": self.name,
+            "tasks": len(self.latencies),
+            "failures": self.failures,
+            "steps": self.step_count,
+            "steps_per_second": round(self.step_count / self.wall, 3) if self.wall else 0,
+            "task_p50": round(percentile(self.latencies, 0.5), 3) if self.latencies else None,
+            "task_p95": round(percentile(self.latencies, 0.95), 3) if self.latencies else None,
+            "model_calls": delta("requests", "chat"),
+            "bytes_per_step": round(chat_bytes / self.step_count) if self.step_count else 0,
+            "peak_rss_mb": round(self.peak_rss / 2 ** 20, 1),
+            "python_max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+def fresh_playbook_store(main, name: str):
+    # playbooks saved by one scenario must not be what the next one replays
+    main.playbook_store = None
+    main.playbook_store_file = f"playbooks-{name}.sqlite"
+
+
+def run_reasoning(main, model_stats, tasks):
+    fresh_playbook_store(main, "reasoning")
+    with main.todoist_worker(0), Scenario("reasoning", model_stats) as scenario:
+        for i in range(tasks):
+            objective = f"Add a task to {items[i % len(items)]}"
+            scenario.task(lambda: main.do_image_reasoning_work("todoist", objective))
+    return scenario.report()
+
+
+def seed_playbook(main):
+    main.savePlaybook(recorded_playbook, "Add a task to buy milk")
+
+
+def run_replay(main, model_stats, tasks):
+    fresh_playbook_store(main, "replay")
+    seed_playbook(main)
+    with main.todoist_worker(0), Scenario("replay", model_stats) as scenario:
+        for i in range(tasks):
+            objective = f"Add a task to {items[i % len(items)]}"
+            scenario.task(lambda: main.replay_history(
+                "todoist", objective, "When the objective seems complete"))
+    return scenario.report()
+
+
+def run_server(main, model_stats, tasks):
+    from werkzeug.serving import make_server
+
+    fresh_playbook_store(main, "server")
+    seed_playbook(main)
+    server = make_server("127.0.0.1", 0, main.create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    main.job_queue.start()
+
+    def request(method, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        req = urllib.request.Request(base_url + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req) as response:
+            return json.loads(response.read())
+
+    def run_job(objective):
+        job = request("POST", "/run", {"prompt": objective,
+                      "completion_condition": "When the objective seems complete"})
+        while job["status"] in ("queued", "running"):
+            time.sleep(0.05)
+            job = request("GET", f"/jobs/{job['job_id']}")
+        if job["status"] != "succeeded":
+            raise Exception(f"Job ended as {job['status']}: {job.get('error')}")
+
+    try:
+        with Scenario("server", model_stats) as scenario:
+            for i in range(tasks):
+                objective = f"Add a task to {items[i % len(items)]}"
+                scenario.task(lambda: run_job(objective))
+        return scenario.report()
+    finally:
+        main.job_queue.stop()
+        server.shutdown()
+
+
+scenarios = {"reasoning": run_reasoning, "replay": run_replay, "server": run_server}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", choices=[*scenarios, "all"], default="all")
+    parser.add_argument("--tasks", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=800,
+                        help="how long the fake model takes to answer")
+    parser.add_argument("--sync-latency-ms", type=float, default=50,
+                        help="how long the fixture site takes to save a change")
+    parser.add_argument("--json", help="also write the reports to this file")
+    args = parser.parse_args()
+    json_file = os.path.abspath(args.json) if args.json else None
+
+    site = start_fixture_site(sync_latency=args.sync_latency_ms / 1000)
+    model_server, model_stats = start_fake_openai(latency=args.latency_ms / 1000)
+
+    # everything the agent writes (profiles, playbooks, caches) goes to a scratch directory
+    os.chdir(tempfile.mkdtemp(prefix="vimbot-bench-"))
+    os.environ.update({
+        "OPENAI_API_KEY": "offline",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{model_server.server_port}/v1",
+        "TODOIST_URL": f"http://127.0.0.1:{site.server_port}/",
+        "CONFIRM_START": "0",
+        "HEADLESS": "1",
+    })
+    import main  # noqa: E402
+
+    reports = []
+    for name in scenarios if args.scenario == "all" else [args.scenario]:
+        print(f"Running the {name} scenario...")
+        reports.append(scenarios[name](main, model_stats, args.tasks))
+
+    print()
+    columns = ["scenario", "tasks", "failures", "steps", "steps_per_second", "task_p50", "task_p95",
+               "model_calls", "bytes_per_step", "peak_rss_mb"]
+    print("  ".join(f"{column:>16}" for column in columns))
+    for report in reports:
+        print("  ".join(f"{str(report[column]):>16}" for column in columns))
+    if json_file:
+        with open(json_file, "w") as f:
+            json.dump(reports, f, indent=2)
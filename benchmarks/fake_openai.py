@@ -0,0 +1,243 @@
+"""A local stand-in for the OpenAI chat completion and embedding endpoints.
+
+The chat endpoint plays scripted tool calls: the objective picks a script, the number of
+steps already in the conversation picks the step, and the hint descriptions in the prompt
+pick the hint to click. Playbooks it is asked to adjust get the text of the new objective.
+Embeddings are deterministic bag-of-words vectors, so similar objectives end up close to
+each other.
+
+    python benchmarks/fake_openai.py [--port 8200] [--latency-ms 800]
+    OPENAI_BASE_URL=http://127.0.0.1:8200/v1 python main.py --classic
+"""
+import argparse
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+embedding_dimensions = 1536
+
+# (objective pattern, steps), a step is (tool, hint text, text to type) with {0} standing
+# for the first group of the pattern
+scripts = [
+    (r"add (?:a )?task (?:to |called )?(.+)", [
+        ("click", 'text="Add task"', None),
+        ("type_and_click", 'name="content"', "{0}"),
+        ("click", 'text="Save task"', None),
+        ("done", None, None),
+    ]),
+    (r"(?:complete|finish|check off) (?:the )?task (?:to |called )?(.+)", [
+        ("click", 'text="Complete task: {0}"', None),
+        ("done", None, None),
+    ]),
+]
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests: dict[str, int] = {}
+        self.request_bytes: dict[str, int] = {}
+        # chat requests still to answer with a 500, and whether to keep the chat request
+        # bodies, to check what a retry sends
+        self.failures = 0
+        self.keep_bodies = False
+        self.chat_bodies: list[bytes] = []
+
+    def record(self, endpoint: str, size: int):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.request_bytes[endpoint] = self.request_bytes.get(endpoint, 0) + size
+
+    def should_fail(self, body: bytes) -> bool:
+        with self.lock:
+            if self.keep_bodies:
+                self.chat_bodies.append(body)
+            if not self.failures:
+                return False
+            self.failures -= 1
+            return True
+
+    def snapshot(self):
+        with self.lock:
+            return {"requests": dict(self.requests), "request_bytes": dict(self.request_bytes)}
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    latency = 0.8
+    stats: Stats
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        request = json.loads(body or b"{}")
+        if self.path.endswith("/chat/completions"):
+            self.stats.record("chat", len(body))
+            time.sleep(self.latency)
+            if self.stats.should_fail(body):
+                self.reply({"error": {"message": "injected failure", "type": "server_error"}}, 500)
+                return
+            self.reply(chat_completion(request))
+        elif self.path.endswith("/embeddings"):
+            self.stats.record("embeddings", len(body))
+            self.reply(embeddings(request))
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.reply(self.stats.snapshot())
+        else:
+            self.send_error(404)
+
+    def reply(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def message_texts(message: dict) -> list[str]:
+    content = message.get("content")
+    if isinstance(content, str):
+        return [content]
+    if isinstance(content, list):
+        return [part["text"] for part in content if part.get("type") == "text"]
+    return []
+
+
+def steps_taken(messages: list[dict]) -> int:
+    # recent steps are tool calls, older ones are numbered lines of a summary
+    recent = sum(1 for message in messages if message.get("role") == "assistant")
+    summarized = [int(number) for message in messages for text in message_texts(message)
+                  if text.startswith("These actions were already performed")
+                  for number in re.findall(r"^(\d+)\. ", text, re.MULTILINE)]
+    return recent + max(summarized, default=0)
+
+
+def find_hint(messages: list[dict], description: str) -> str | None:
+    hints = re.findall(r"^([A-Z]{1,2}): (.*)$", "\n".join(message_texts(messages[-1])), re.MULTILINE)
+    for hint, hint_description in hints:
+        if description.casefold() in hint_description.casefold():
+            return hint
+    return None
+
+
+def next_action(messages: list[dict], tool_names: list[str]) -> tuple[str, dict]:
+    text = "\n".join(text for message in messages for text in message_texts(message))
+    objective = re.search(r"your objective is: (.*?) and the completion condition is:", text, re.DOTALL)
+    for pattern, steps in scripts:
+        match = re.search(pattern, objective.group(1).strip(), re.IGNORECASE) if objective else None
+        if not match:
+            continue
+        step = steps_taken(messages)
+        if step >= len(steps):
+            break
+        tool, target, value = steps[step]
+        if tool == "done":
+            break
+        hint = find_hint(messages, target.format(*match.groups()))
+        if hint is None:
+            if "need_screenshot" in tool_names:
+                return "need_screenshot", {"reason": f"no element matches {target}"}
+            break
+        arguments = {"click": hint, "description": f"{tool} {target}"}
+        if value is not None:
+            arguments["type"] = value.format(*match.groups())
+        return tool, arguments
+    return "done", {}
+
+
+def adjusted_playbook(messages: list[dict]) -> dict:
+    # what the model does with a playbook: the text typed for the old objective becomes the new one
+    text = "\n".join(text for message in messages for text in message_texts(message))
+    original = re.search(r"generated for the following objective (.*)\.$", text, re.MULTILINE).group(1)
+    incoming = re.search(r"for the new objective: (.*)\.$", text, re.MULTILINE).group(1)
+    steps = json.loads(re.search(r"The playbook is: (.*)\.$", text, re.MULTILINE).group(1))
+    for pattern, _ in scripts:
+        old, new = (re.search(pattern, objective.strip(), re.IGNORECASE) for objective in (original, incoming))
+        if old and new:
+            for step in steps:
+                if "type" in step:
+                    step["type"] = step["type"].replace(old.group(1), new.group(1))
+    return {"steps": steps}
+
+
+def chat_completion(request: dict) -> dict:
+    messages = request.get("messages", [])
+    prompt_tokens = len(json.dumps(messages)) // 4
+    tool_names = [tool["function"]["name"] for tool in request.get("tools") or []]
+    if tool_names:
+        if "adjusted_playbook" in tool_names:
+            tool, arguments = "adjusted_playbook", adjusted_playbook(messages)
+        else:
+            tool, arguments = next_action(messages, tool_names)
+        message = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": tool, "arguments": json.dumps(arguments)},
+            }],
+        }
+        finish_reason = "tool_calls"
+    else:
+        message = {"role": "assistant", "content": "[]"}
+        finish_reason = "stop"
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "fake"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 20, "total_tokens": prompt_tokens + 20},
+    }
+
+
+def embed(text: str) -> list[float]:
+    vector = np.zeros(embedding_dimensions)
+    for word in re.findall(r"\w+", text.casefold()):
+        seed = int.from_bytes(hashlib.sha256(word.encode()).digest()[:8], "little")
+        vector += np.random.default_rng(seed).standard_normal(embedding_dimensions)
+    return vector.tolist()
+
+
+def embeddings(request: dict) -> dict:
+    inputs = request.get("input", [])
+    inputs = [inputs] if isinstance(inputs, str) else inputs
+    return {
+        "object": "list",
+        "data": [{"object": "embedding", "index": index, "embedding": embed(text)}
+                 for index, text in enumerate(inputs)],
+        "model": request.get("model", "fake"),
+        "usage": {"prompt_tokens": 0, "total_tokens": 0},
+    }
+
+
+def start_fake_openai(port: int = 0, latency: float = 0.8) -> tuple[ThreadingHTTPServer, Stats]:
+    """Start the server on a background thread, port 0 picks a free port."""
+    stats = Stats()
+    handler = type("Handler", (FakeOpenAIHandler,), {"latency": latency, "stats": stats})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    args = parser.parse_args()
+    server, _ = start_fake_openai(args.port, args.latency_ms / 1000)
+    print(f"Serving the fake OpenAI API on http://127.0.0.1:{server.server_port}/v1")
+    threading.Event().wait()
@@ -0,0 +1,57 @@
+"""Serve the Todoist stand-in in benchmarks/fixtures/todoist.
+
+    python benchmarks/fixture_site.py [--port 8100] [--sync-latency-ms 50]
+"""
+import argparse
+import os
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+fixture_dir = os.path.join(os.path.dirname(__file__), "fixtures", "todoist")
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    sync_latency = 0.05
+
+    def do_POST(self):
+        # the app's save requests, answered after a delay like a real backend
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if not self.path.startswith("/api/"):
+            self.send_error(404)
+            return
+        time.sleep(self.sync_latency)
+        body = b'{"sync_status": {}}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def end_headers(self):
+        self.send_header("Cache-Control", "no-store")
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fixture_site(port: int = 0, sync_latency: float = 0.05) -> ThreadingHTTPServer:
+    """Start the site on a background thread, port 0 picks a free port."""
+    handler = type("Handler", (FixtureHandler,), {"sync_latency": sync_latency})
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", port), partial(handler, directory=fixture_dir))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--sync-latency-ms", type=float, default=50)
+    args = parser.parse_args()
+    server = start_fixture_site(args.port, args.sync_latency_ms / 1000)
+    print(f"Serving the fixture site on http://127.0.0.1:{server.server_port}")
+    threading.Event().wait()
@@ -0,0 +1,72 @@
+// A tiny stand-in for the Todoist web app: a task list, an editor to add tasks and
+// checkboxes to complete them. Changes are sent to /api/v9/sync like the real app does.
+(() => {
+    const tasks = [
+        { id: 1, content: "Call the plumber", done: false },
+        { id: 2, content: "Pay the electricity bill", done: false },
+        { id: 3, content: "Book flights for the summer", done: false },
+        { id: 4, content: "Water the plants", done: false },
+    ];
+    let nextId = tasks.length + 1;
+
+    const list = document.getElementById("tasks");
+    const editor = document.getElementById("editor");
+    const content = editor.elements.namedItem("content");
+
+    function render() {
+        list.replaceChildren(...tasks.map((task) => {
+            const item = document.createElement("li");
+            item.className = task.done ? "done" : "";
+            const check = document.createElement("button");
+            check.className = "check";
+            check.setAttribute("aria-label", `${task.done ? "Reopen" : "Complete"} task: ${task.content}`);
+            check.addEventListener("click", () => {
+                task.done = !task.done;
+                sync({ type: task.done ? "item_complete" : "item_uncomplete", id: task.id }).then(render);
+            });
+            const text = document.createElement("span");
+            text.textContent = task.content;
+            item.append(check, text);
+            return item;
+        }));
+    }
+
+    function sync(command) {
+        return fetch("/api/v9/sync", {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ commands: [command] }),
+        });
+    }
+
+    document.querySelector('button[aria-controls="sidebar"]').addEventListener("click", () => {
+        document.getElementById("sidebar").classList.toggle("open");
+    });
+
+    document.querySelector('button[aria-label="Add task"]').addEventListener("click", () => {
+        editor.classList.add("open");
+        content.focus();
+    });
+
+    document.querySelector('button[aria-label="Cancel"]').addEventListener("click", () => {
+        editor.reset();
+        editor.classList.remove("open");
+    });
+
+    editor.addEventListener("submit", (event) => {
+        event.preventDefault();
+        const text = content.value.trim();
+        if (!text) {
+            return;
+        }
+        const task = { id: nextId++, content: text, done: false };
+        sync({ type: "item_add", id: task.id, content: text }).then(() => {
+            tasks.push(task);
+            editor.reset();
+            editor.classList.remove("open");
+            render();
+        });
+    });
+
+    render();
+})();
@@ -0,0 +1,87 @@
+// Emulates the parts of our vimium build the agent relies on, so the fixture works
+// without the extension: the ACTIVATE_VIMIUM / DEACTIVATE_VIMIUM messages, hint markers
+// with a data-xpath attribute, and the d / u scroll keys.
+(() => {
+    if (window.__vimiumFixture) {
+        return;
+    }
+    window.__vimiumFixture = true;
+
+    const hintCharacters = "SADFJKLEWCMPGH";
+    const clickable = "a[href], button, input, select, textarea, [contenteditable], [role=button]";
+
+    function xpathFor(element) {
+        const parts = [];
+        for (let current = element; current && current.nodeType === Node.ELEMENT_NODE; current = current.parentElement) {
+            const siblings = Array.from(current.parentElement ? current.parentElement.children : [current])
+                .filter((sibling) => sibling.tagName === current.tagName);
+            parts.unshift(`${current.tagName.toLowerCase()}[${siblings.indexOf(current) + 1}]`);
+        }
+        return "/" + parts.join("/");
+    }
+
+    function hintStrings(count) {
+        // single letters while they last, two letters after that
+        if (count <= hintCharacters.length) {
+            return hintCharacters.slice(0, count).split("");
+        }
+        const strings = [];
+        for (const first of hintCharacters) {
+            for (const second of hintCharacters) {
+                strings.push(first + second);
+            }
+        }
+        return strings.slice(0, count);
+    }
+
+    function visible(element) {
+        const rect = element.getBoundingClientRect();
+        return rect.width > 0 && rect.height > 0 && rect.bottom > 0 && rect.top < window.innerHeight
+            && getComputedStyle(element).visibility !== "hidden";
+    }
+
+    function activate() {
+        deactivate();
+        const elements = Array.from(document.querySelectorAll(clickable)).filter(visible);
+        const container = document.createElement("div");
+        container.id = "vimiumHintMarkerContainer";
+        hintStrings(elements.length).forEach((hint, index) => {
+            const rect = elements[index].getBoundingClientRect();
+            const marker = document.createElement("div");
+            marker.className = "vimiumHintMarker";
+            marker.setAttribute("data-xpath", xpathFor(elements[index]));
+            marker.textContent = hint;
+            marker.style.cssText = `position:fixed;left:${rect.left}px;top:${rect.top}px;z-index:2147483647;`
+                + "padding:0 3px;font:bold 11px monospace;background:#fff785;border:1px solid #c38a22;"
+                + "pointer-events:none;";
+            container.appendChild(marker);
+        });
+        document.documentElement.appendChild(container);
+    }
+
+    function deactivate() {
+        const container = document.getElementById("vimiumHintMarkerContainer");
+        if (container) {
+            container.remove();
+        }
+    }
+
+    window.addEventListener("message", (event) => {
+        if (event.data && event.data.type === "ACTIVATE_VIMIUM") {
+            activate();
+        } else if (event.data && event.data.type === "DEACTIVATE_VIMIUM") {
+            deactivate();
+        }
+    });
+
+    document.addEventListener("keydown", (event) => {
+        const target = event.target;
+        const editing = target instanceof HTMLInputElement || target instanceof HTMLTextAreaElement
+            || (target instanceof HTMLElement && target.isContentEditable);
+        if (event.key === "Escape") {
+            deactivate();
+        } else if (!editing && (event.key === "d" || event.key === "u")) {
+            window.scrollBy(0, (event.key === "d" ? 1 : -1) * window.innerHeight / 2);
+        }
+    });
+})();
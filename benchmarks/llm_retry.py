@@ -0,0 +1,49 @@
+"""Check that a retried OpenAI call sends the same request as the first attempt.
+
+Builds a conversation with a few steps the way the reasoning loop does, lets the fake
+OpenAI server (benchmarks/fake_openai.py) fail the first attempts with a 500 and compares
+the bodies of every attempt. Exits non-zero when they differ.
+
+    python benchmarks/llm_retry.py [--failures 2]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fake_openai import start_fake_openai  # noqa: E402
+from llmClient import LLMClient  # noqa: E402
+from perception import (build_function_calls, build_initial_prompt, build_messages,  # noqa: E402
+                        build_subsequent_prompt, default_context_policy, text_model,
+                        tool_calls_for_action)
+
+
+def conversation():
+    hints = {"A": 'button text="Add task"', "B": 'input name="content"'}
+    history = [build_initial_prompt("add a task called buy milk", "the task is in the list",
+                                    "http://127.0.0.1/", hints)]
+    for action in ({"click": "A"}, {"click": "B", "type": "buy milk"}):
+        history.append(tool_calls_for_action(action))
+    next_message = {"role": "user", "content": build_subsequent_prompt("http://127.0.0.1/", hints)}
+    return build_messages(history, next_message, default_context_policy)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--failures", type=int, default=2)
+    args = parser.parse_args()
+
+    server, stats = start_fake_openai(latency=0)
+    client = LLMClient(api_key="offline", base_url=f"http://127.0.0.1:{server.server_port}/v1",
+                       max_retries=args.failures, backoff=0.01)
+    stats.keep_bodies = True
+    stats.failures = args.failures
+    client.chat(model=text_model, messages=conversation(), tools=build_function_calls(), max_tokens=130)
+    bodies = stats.chat_bodies
+    server.shutdown()
+
+    same = len(bodies) == args.failures + 1 and all(body == bodies[0] for body in bodies)
+    print(f"{len(bodies)} attempts, {'the same request every time' if same else 'the requests DIFFER'}")
+    sys.exit(0 if same else 1)
@@ -0,0 +1,49 @@
+"""Check that the model adjusts a playbook that can not be filled in locally.
+
+Asks the fake OpenAI server (benchmarks/fake_openai.py) to adjust a playbook recorded without
+a template the way main.adjust_playbook does, and exits non-zero unless the result is a list
+with the same steps, the new text typed and the checkpoints kept.
+
+    python benchmarks/playbook_adjust.py
+"""
+import copy
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fake_openai import start_fake_openai  # noqa: E402
+
+recorded_steps = [
+    {"click": "A", "clicked_element": 'button[aria-label="Add task"]', "checkpoint": {"url": "/app/today"}},
+    {"click": "B", "type": "buy milk", "clicked_element": 'input[name="content"]', "checkpoint": {"url": "/app/today"}},
+    {"click": "C", "clicked_element": 'button[aria-label="Save task"]', "checkpoint": {"url": "/app/today"}},
+    {"done": True},
+]
+
+if __name__ == "__main__":
+    server, stats = start_fake_openai(latency=0)
+    os.environ.update({
+        "OPENAI_API_KEY": "offline",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{server.server_port}/v1",
+    })
+    import main  # noqa: E402
+
+    # no template, e.g. a playbook saved before templates were extracted
+    playbook = {"objective": "Add a task to buy milk", "steps": copy.deepcopy(recorded_steps), "template": None}
+    adjusted = main.adjust_playbook(playbook, "Add a task to call mom")
+    server.shutdown()
+
+    problems = []
+    if not isinstance(adjusted, list) or len(adjusted) != len(recorded_steps):
+        problems.append(f"expected {len(recorded_steps)} steps, got {adjusted!r}")
+    else:
+        if adjusted[1].get("type") != "call mom":
+            problems.append(f"the second step types {adjusted[1].get('type')!r}")
+        if [step.get("checkpoint") for step in adjusted] != [step.get("checkpoint") for step in recorded_steps]:
+            problems.append("the checkpoints were not kept")
+    if stats.snapshot()["requests"].get("chat") != 1:
+        problems.append("the model was not asked")
+    print("; ".join(problems) or "the model adjusted the playbook")
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,78 @@
+"""Compare replaying a recorded playbook step by step with the compiled plan.
+
+Replays a playbook that adds a task on the local Todoist stand-in
+(benchmarks/fixture_site.py) both ways and reports the time per replay and the speed-up.
+
+    python benchmarks/playbook_replay.py [--iterations 20] [--text "buy milk"]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from playwright.sync_api import sync_playwright
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fixture_site import start_fixture_site  # noqa: E402
+from browserAgent import BrowserAgent  # noqa: E402
+from playbookCompiler import compile_playbook, run_plan  # noqa: E402
+
+
+def recorded_playbook(text: str):
+    return [
+        {"scroll": "down"},
+        {"click": "A", "clicked_element": 'button[aria-label="Add task"]'},
+        {"click": "B", "type": text, "clicked_element": 'input[name="content"]'},
+        {"click": "C", "clicked_element": 'button[aria-label="Save task"]'},
+        {"done": True},
+    ]
+
+
+def step_by_step(agent: BrowserAgent, playbook):
+    for action in playbook:
+        agent.perform_action(action)
+
+
+def compiled(agent: BrowserAgent, playbook):
+    plan = compile_playbook(playbook)
+    if run_plan(agent, plan) != plan.end:
+        raise Exception("The compiled plan stopped early")
+    for action in playbook[plan.end:]:
+        agent.perform_action(action)
+
+
+def measure(agent: BrowserAgent, home_url: str, replay, playbook, iterations) -> list[float]:
+    timings = []
+    for _ in range(iterations):
+        agent.navigate(home_url)
+        agent.page.wait_for_selector('button[aria-controls="sidebar"]')
+        start = time.perf_counter()
+        replay(agent, playbook)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--text", default="Renew the passport before the summer holidays")
+    args = parser.parse_args()
+
+    site = start_fixture_site(sync_latency=0)
+    home_url = f"http://127.0.0.1:{site.server_port}/"
+    playbook = recorded_playbook(args.text)
+    with sync_playwright() as playwright:
+        agent = BrowserAgent(headless=True, user_data_dir="", playwright=playwright)
+        results = {}
+        for name, replay in (("step by step", step_by_step), ("compiled", compiled)):
+            # one warm-up replay, so both paths find the page in the browser's cache
+            measure(agent, home_url, replay, playbook, 1)
+            results[name] = measure(agent, home_url, replay, playbook, args.iterations)
+            timings = results[name]
+            print(f"{name:<14} mean {statistics.mean(timings):7.1f} ms   "
+                  f"p95 {sorted(timings)[int(len(timings) * 0.95) - 1]:7.1f} ms")
+        agent.close()
+    print(f"speed-up       {statistics.mean(results['step by step']) / statistics.mean(results['compiled']):.1f}x")
@@ -0,0 +1,60 @@
+"""Compare the old PNG -> PIL -> PNG screenshot path with encoding in the browser.
+
+    python benchmarks/screenshot_encoding.py [url] [--iterations 20]
+"""
+import argparse
+import base64
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+
+from PIL import Image
+from playwright.sync_api import sync_playwright
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from browserAgent import BrowserAgent  # noqa: E402
+from perception import IMG_RES  # noqa: E402
+
+sample_page = "data:text/html," + "".join(
+    f"<p style='font:16px sans-serif;color:#{i * 40503 % 0xffffff:06x}'>Task {i}: buy milk and call the plumber</p>"
+    for i in range(60))
+
+
+def legacy_capture(agent: BrowserAgent):
+    # what a step did before: PNG from playwright, PIL decode, resize, PNG again
+    image = Image.open(BytesIO(agent.page.screenshot())).convert("RGB")
+    W, H = image.size
+    image = image.resize((IMG_RES, int(IMG_RES * H / W)))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+def measure(name, capture, iterations):
+    timings = []
+    payload = ""
+    for _ in range(iterations):
+        start = time.perf_counter()
+        payload = capture()
+        timings.append((time.perf_counter() - start) * 1000)
+    print(f"{name:<12} mean {statistics.mean(timings):7.1f} ms   "
+          f"p95 {sorted(timings)[int(len(timings) * 0.95) - 1]:7.1f} ms   "
+          f"payload {len(payload) / 1024:7.1f} KiB (base64)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("url", nargs="?", default=sample_page)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    with sync_playwright() as playwright:
+        agent = BrowserAgent(headless=True, user_data_dir="./data-benchmark", playwright=playwright)
+        agent.page.goto(args.url)
+        measure("legacy png", lambda: legacy_capture(agent), args.iterations)
+        for format in ("png", "jpeg", "webp"):
+            measure(format, lambda: agent.capture(False, width=IMG_RES, format=format).base64(), args.iterations)
+        agent.close()
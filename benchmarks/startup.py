@@ -0,0 +1,103 @@
+"""Startup checks for main.py.
+
+Imports main.py in fresh interpreters the way each entry point does and fails when one of
+them imports a heavy module it does not need or starts a thread before any work was asked
+for. Taking longer than the budget is a warning, or a failure with --enforce-budget, since
+timings depend on the machine:
+
+    import  importing main.py, what every mode pays
+    reset   --reset, which only needs the playbook store
+    server  building the Flask app, before any job ran
+
+    python benchmarks/startup.py [--runs 5] [--budget-scale 1.0] [--enforce-budget]
+
+It exits non-zero on a failure and runs as the startup-budget pre-commit hook. An entry
+point whose third party dependencies are not installed is skipped.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# (name, code run after importing main, budget in ms, modules that must not be imported)
+entry_points = [
+    ("import", "", 300, ["openai", "playwright", "PIL", "numpy", "flask"]),
+    ("reset", "main.reset_playbook()", 500, ["openai", "playwright", "PIL", "flask"]),
+    ("server", "main.create_app()", 500, ["openai", "playwright", "PIL", "numpy"]),
+]
+
+probe = """
+import json, sys, threading, time
+start = time.perf_counter()
+sys.path.insert(0, {repo_dir!r})
+import main
+{code}
+print(json.dumps({{"ms": (time.perf_counter() - start) * 1000, "modules": sorted(sys.modules),
+                  "threads": [thread.name for thread in threading.enumerate() if thread is not threading.main_thread()]}}))
+"""
+
+
+def measure(code: str) -> dict:
+    # every run gets a fresh interpreter (and bytecode that is already compiled)
+    process = subprocess.run(
+        [sys.executable, "-c", probe.format(repo_dir=repo_dir, code=code)],
+        capture_output=True, text=True,
+        env={**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "offline")},
+    )
+    if process.returncode:
+        lines = process.stderr.strip().splitlines()
+        return {"error": lines[-1] if lines else f"exited with {process.returncode}"}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def missing_dependency(error: str) -> str | None:
+    # a module of this repo that can not be found is a bug, a third party one is just not installed
+    match = re.match(r"ModuleNotFoundError: No module named '([\w.]+)'", error)
+    if not match:
+        return None
+    name = match.group(1).split(".")[0]
+    local = os.path.exists(os.path.join(repo_dir, f"{name}.py")) or os.path.isdir(os.path.join(repo_dir, name))
+    return None if local else name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-scale", type=float, default=1.0,
+                        help="multiplies every budget, for slow machines")
+    parser.add_argument("--enforce-budget", action="store_true",
+                        help="fail instead of warning when an entry point is over its budget")
+    args = parser.parse_args()
+
+    # the playbook store and caches are created in the working directory
+    os.chdir(tempfile.mkdtemp(prefix="vimbot-startup-"))
+    failures = []
+    for name, code, budget, forbidden in entry_points:
+        runs = [measure(code) for _ in range(args.runs + 1)][1:]
+        errors = [run["error"] for run in runs if "error" in run]
+        if errors:
+            dependency = missing_dependency(errors[0])
+            if dependency:
+                print(f"{name:>8}  skipped, {dependency} is not installed")
+            else:
+                print(f"{name:>8}  FAILED  {errors[0]}")
+                failures.append(name)
+            continue
+        best = min(run["ms"] for run in runs)
+        imported = [module for module in forbidden if module in runs[0]["modules"]]
+        threads = runs[0]["threads"]
+        limit = budget * args.budget_scale
+        over_budget = best > limit
+        ok = not imported and not threads and not (over_budget and args.enforce_budget)
+        status = "FAILED" if not ok else "over budget" if over_budget else "ok"
+        print(f"{name:>8}  {best:7.1f} ms  (budget {limit:.0f} ms)  {status}"
+              + (f"  imports {', '.join(imported)}" if imported else "")
+              + (f"  starts threads {', '.join(threads)}" if threads else ""))
+        if not ok:
+            failures.append(name)
+    sys.exit(1 if failures else 0)
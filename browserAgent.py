@@ -1,33 +1,92 @@
+import base64
+import os
+import re
 import time
-from io import BytesIO
 
-from PIL import Image
-from playwright.sync_api import sync_playwright, Locator
-from dataclasses import dataclass
+from playwright.sync_api import sync_playwright, CDPSession, Page, Request, Error as PlaywrightError
+
+from screenshot import Screenshot, ScreenshotFormat, screenshot_format, screenshot_quality
+from sessionState import local_storage_script
+from telemetry import span
 
 vimium_path = "./vimium-master"
+default_user_data_dir = "./data"
+with open(os.path.join(os.path.dirname(__file__), "hintAgent.js")) as f:
+    hint_agent_script = f.read()
+
+
+def hint_agent_call(method: str) -> str:
+    # null when the agent is not installed, the result is wrapped so a null result differs
+    return f"() => window.__vimbot ? {{ value: window.__vimbot.{method}() }} : null"
+
 
+default_headless = os.getenv("HEADLESS", "0") == "1"
+ready_timeout = int(os.getenv("READY_TIMEOUT_MS", "5000"))
+# requests that stay open by design and would keep the network from ever going idle
+long_lived_resource_types = ("websocket", "eventsource")
+# what a replay of recorded selectors does not need: images, fonts, media and analytics
+default_blocked_urls = ",".join([
+    "*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*", "*.avif*", "*.svg*", "*.ico*",
+    "*.woff*", "*.ttf*", "*.otf*",
+    "*.mp4*", "*.webm*", "*.mp3*", "*.ogg*",
+    "*google-analytics.com*", "*googletagmanager.com*", "*doubleclick.net*", "*segment.io*",
+    "*segment.com*", "*sentry.io*", "*amplitude.com*", "*mixpanel.com*", "*hotjar.com*", "*intercom.io*",
+])
+replay_blocked_urls = [pattern.strip() for pattern in os.getenv(
+    "REPLAY_BLOCKED_URLS", default_blocked_urls).split(",") if pattern.strip()]
+# images that failed to load while they were blocked
+reload_broken_images_script = '''() => {
+    for (const image of document.images) {
+        if (!image.complete || image.naturalWidth === 0) {
+            image.src = image.src;
+        }
+    }
+}'''
 
-@dataclass
-class PlaywrightLocatorResult:
-    locator: Locator
-    selector: str
+# resolves true once the DOM did not change for quietMs, false when timeoutMs passed first
+dom_quiet_script = '''({ quietMs, timeoutMs }) => new Promise((resolve) => {
+    let quietTimer;
+    const done = (quiet) => {
+        observer.disconnect();
+        clearTimeout(quietTimer);
+        clearTimeout(limitTimer);
+        resolve(quiet);
+    };
+    const observer = new MutationObserver(() => {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(() => done(true), quietMs);
+    });
+    observer.observe(document, { subtree: true, childList: true, attributes: true, characterData: true });
+    quietTimer = setTimeout(() => done(true), quietMs);
+    const limitTimer = setTimeout(() => done(false), timeoutMs);
+})'''
 
-    def __getitem__(self, item):
-        return getattr(self, item)
+
+def page_clip(clip: dict, layout_metrics: dict) -> dict:
+    # Page.captureScreenshot clips in document coordinates, so a scrolled window moves the clip along
+    viewport = layout_metrics.get("cssVisualViewport") or layout_metrics["visualViewport"]
+    return {**clip, "x": clip["x"] + viewport["pageX"], "y": clip["y"] + viewport["pageY"]}
 
 
 class BrowserAgent:
-    def __init__(self, headless=False):
-        self.playwright = sync_playwright().start()
+    def __init__(self, headless: bool | None = None, user_data_dir=default_user_data_dir, playwright=None):
+        if headless is None:
+            headless = default_headless
+        # agents may share one playwright instance (e.g. when pooled), in which case
+        # the owner of the instance is responsible for stopping it
+        self.owns_playwright = playwright is None
+        self.playwright = playwright or sync_playwright().start()
         self.context = (
             self.playwright
             .chromium.launch_persistent_context(
-                user_data_dir='./data',
-                headless=headless,
+                user_data_dir=user_data_dir,
+                # playwright's headless mode is chromium's old one, which can not load
+                # extensions, the new one can
+                headless=False,
                 args=[
                     f"--disable-extensions-except={vimium_path}",
                     f"--load-extension={vimium_path}",
+                    *(["--headless=new"] if headless else []),
                 ],
                 ignore_https_errors=True,
             )
@@ -35,55 +94,100 @@ class BrowserAgent:
 
         self.page = self.context.new_page()
         self.page.set_viewport_size({"width": 360, "height": 844})
+        self.cdp_session: tuple[Page, CDPSession] | None = None
+        self.hint_snapshot: dict[str, dict] | None = None
+        self.blocked_urls: list[str] = []
+        self.session_state: dict | None = None
+        self.context.add_init_script(hint_agent_script)
+        self.track_requests()
 
     def close(self):
-        self.playwright.stop()
+        if self.owns_playwright:
+            self.playwright.stop()
+        else:
+            self.context.close()
+
+    def is_healthy(self) -> bool:
+        try:
+            return not self.page.is_closed() and self.page.evaluate("() => true")
+        except Exception:
+            return False
+
+    def reset(self, url):
+        # drop any tabs opened during the last task and go back to the start page
+        for page in self.context.pages:
+            if page != self.page:
+                page.close()
+        self.unblock_resources(reload_images=False)
+        self.hideHints()
+        self.navigate(url)
+
+    def restore_session(self, state: dict):
+        # cookies right away, localStorage once a page of its origin loads
+        self.context.add_cookies(state.get("cookies", []))
+        self.context.add_init_script(local_storage_script(state))
+        self.session_state = state
+
+    def export_session(self) -> dict:
+        return self.context.storage_state()
+
+    def block_resources(self, patterns: list[str] = replay_blocked_urls):
+        # blocked by chromium itself, routing the requests through playwright
+        # would also turn off the http cache
+        self.blocked_urls = list(patterns)
+        self.apply_blocked_urls(self.get_cdp_session())
+
+    def unblock_resources(self, reload_images=True):
+        if not self.blocked_urls:
+            return
+        self.blocked_urls = []
+        self.apply_blocked_urls(self.get_cdp_session())
+        if reload_images:
+            self.page.evaluate(reload_broken_images_script)
+
+    def apply_blocked_urls(self, session: CDPSession):
+        session.send("Network.enable")
+        session.send("Network.setBlockedURLs", {"urls": self.blocked_urls})
 
     def perform_action(self, action):
-        print(f"Performing action: {action}")
-        if "done" in action:
-            return True
-        if "query_result" in action:
-            return action
-        if "click" in action and "type" in action:
-            if "clicked_element" in action:
-                self.page.locator(action["clicked_element"]).click()
-            else:
-                self.click(text=action["click"])
-            self.type(action["type"])
-        elif "navigate" in action:
-            self.navigate(action["navigate"])
-        elif "type" in action:
-            self.type(action["type"])
-        elif "scroll" in action:
-            self.scroll(action["scroll"])
-        elif "click" in action:
-            if "clicked_element" in action:
-                self.page.locator(action["clicked_element"]).click()
-            else:
-                self.click(text=action["click"])
+        with span("browser.perform_action", action=next(iter(action), None)):
+            print(f"Performing action: {action}")
+            if "done" in action:
+                return True
+            if "query_result" in action:
+                return action
+            if "click" in action and "type" in action:
+                if "clicked_element" in action:
+                    self.page.locator(action["clicked_element"]).click()
+                else:
+                    self.click(text=action["click"])
+                self.type(action["type"])
+            elif "navigate" in action:
+                self.navigate(action["navigate"])
+            elif "type" in action:
+                self.type(action["type"])
+            elif "scroll" in action:
+                self.scroll(action["scroll"])
+            elif "click" in action:
+                if "clicked_element" in action:
+                    self.page.locator(action["clicked_element"]).click()
+                else:
+                    self.click(text=action["click"])
+            # whatever we did, the hints on screen are stale now
+            self.hint_snapshot = None
 
     def get_selector(self, action) -> str | None:
         if "click" in action:
-            xpath = self.get_x_path(action["click"])
-            locator = self.page.locator(f"xpath={xpath}")
-            handle = locator.element_handle()
-            res: PlaywrightLocatorResult = self.page.evaluate('''
-                (handle) => {
-                    return {
-                        selector: window.playwright.selector(handle),
-                        locator: window.playwright.generateLocator(handle),
-                    }
-                }''', handle)
-
-            return res['selector']
+            hint = self.snapshot().get(action["click"])
+            return hint["selector"] if hint else None
 
     def navigate(self, url):
+        self.hint_snapshot = None
         self.page.goto(
             url=url if "://" in url else "https://" + url, timeout=60000)
 
     def type(self, text):
-        time.sleep(1)
+        self.wait_for_editable()
         self.page.keyboard.type(text)
 
     def click(self, text):
@@ -92,8 +196,87 @@ class BrowserAgent:
         locator = self.page.locator(f"xpath={xpath}")
         locator.click(force=True)
         self.page = self.context.pages[-1]
+        if self.blocked_urls:
+            # the click may have opened a new tab, which needs its own block list
+            self.get_cdp_session()
+
+    def track_requests(self):
+        self.inflight_requests: set[Request] = set()
+        self.last_network_activity = time.monotonic()
+
+        def started(request: Request):
+            if request.resource_type not in long_lived_resource_types:
+                self.inflight_requests.add(request)
+                self.last_network_activity = time.monotonic()
+
+        def finished(request: Request):
+            self.inflight_requests.discard(request)
+            self.last_network_activity = time.monotonic()
+
+        self.context.on("request", started)
+        self.context.on("requestfinished", finished)
+        self.context.on("requestfailed", finished)
+
+    def wait_until_ready(self, timeout=ready_timeout) -> bool:
+        # network first, the DOM usually settles right after the data arrives
+        with span("browser.wait_until_ready"):
+            deadline = time.monotonic() + timeout / 1000
+            network_idle = self.wait_for_network_idle(timeout=timeout)
+            remaining = max(0, int((deadline - time.monotonic()) * 1000))
+            return self.wait_for_dom_quiet(timeout=remaining) and network_idle
+
+    def wait_for_network_idle(self, idle_ms=250, timeout=ready_timeout) -> bool:
+        return self.wait_for(
+            lambda: not self.inflight_requests and
+            time.monotonic() - self.last_network_activity >= idle_ms / 1000,
+            timeout)
+
+    def wait_for_pending_requests(self, url_pattern: str, timeout=ready_timeout) -> bool:
+        # e.g. todoist keeps its sync request open until a change is saved
+        pattern = re.compile(url_pattern)
+        return self.wait_for(
+            lambda: not any(pattern.search(request.url)
+                            for request in self.inflight_requests),
+            timeout)
+
+    def wait_for_dom_quiet(self, quiet_ms=200, timeout=ready_timeout) -> bool:
+        try:
+            return self.page.evaluate(dom_quiet_script, {"quietMs": quiet_ms, "timeoutMs": timeout})
+        except PlaywrightError:
+            # the page navigated away while we were watching it
+            return False
+
+    def wait_for_editable(self, timeout=ready_timeout) -> bool:
+        try:
+            self.page.wait_for_function('''
+                () => {
+                    const element = document.activeElement;
+                    if (!element) {
+                        return false;
+                    }
+                    if (element.isContentEditable) {
+                        return true;
+                    }
+                    const tagName = element.tagName.toLowerCase();
+                    return (tagName === 'input' || tagName === 'textarea') && !element.disabled && !element.readOnly;
+                }
+                ''', timeout=timeout)
+            return True
+        except PlaywrightError:
+            print("No editable element is focused, typing anyway...")
+            return False
+
+    def wait_for(self, condition, timeout=ready_timeout) -> bool:
+        deadline = time.monotonic() + timeout / 1000
+        while not condition():
+            if time.monotonic() >= deadline:
+                return False
+            # lets playwright dispatch the request events while we wait
+            self.page.wait_for_timeout(25)
+        return True
 
     def showHints(self, withVimBindings: bool = True):
+        self.hint_snapshot = None
         self.page.evaluate('''
                            () => {
                                const data = { type: "ACTIVATE_VIMIUM", text: "Activate_Vimium" };
@@ -102,6 +285,7 @@ class BrowserAgent:
                            ''')
 
     def hideHints(self, withVimBindings: bool = True):
+        self.hint_snapshot = None
         self.page.evaluate('''
                            () => {
                                const data = { type: "DEACTIVATE_VIMIUM", text: "Deactivate_Vimium" };
@@ -109,6 +293,17 @@ class BrowserAgent:
                            }
                            ''')
 
+    def wait_for_hints(self, timeout=2000) -> bool:
+        with span("browser.wait_for_hints"):
+            self.showHints()
+            try:
+                self.page.wait_for_selector(
+                    "#vimiumHintMarkerContainer", state="attached", timeout=timeout)
+                return True
+            except PlaywrightError:
+                # nothing on the page can be clicked
+                return False
+
     def scroll(self, direction):
         self.page.keyboard.press("Escape")
         if direction == "down":
@@ -116,96 +311,89 @@ class BrowserAgent:
         elif direction == "up":
             self.page.keyboard.type("u")
 
+    def snapshot(self) -> dict[str, dict]:
+        # xpath, description and selector of every hint on screen, fetched once per frame
+        if self.hint_snapshot is None:
+            with span("browser.snapshot"):
+                self.hint_snapshot = self.call_hint_agent("snapshot") or {}
+        return self.hint_snapshot
+
+    def call_hint_agent(self, method: str):
+        # the init script installs the agent on every new document, it is only sent again
+        # for pages that were open before it was registered
+        result = self.page.evaluate(hint_agent_call(method))
+        if result is None:
+            self.page.evaluate(f"() => {{ {hint_agent_script} }}")
+            result = self.page.evaluate(hint_agent_call(method))
+        return result["value"]
+
     def get_x_paths_for_all_hints(self) -> dict[str, str]:
-        return self.page.evaluate('''
-            () => {
-                const container = document.getElementById('vimiumHintMarkerContainer')
-                if (!container) {
-                    return null
-                }
-                var xPaths = {};
-                for (let i = 0; i < container.children.length; i++) {
-                    const hint = container.children[i]
-                    if (!hint.getAttribute('data-xpath')) {
-                        continue;
-                    }
-                    const xPathResult = document.evaluate(hint.getAttribute('data-xpath'), document, null, XPathResult.ANY_TYPE, null);
-                    if (!xPathResult) {
-                        continue;
-                    }
-                    const element = xPathResult.iterateNext()
-                    if (!element) {
-                        continue;
-                    }
-                    const tagName = element.tagName.toLowerCase()
-                    let hintStrs = []
-                    if (tagName) {
-                        hintStrs.push(`type="${tagName}"`)
-                    }
-                    if (element.getAttribute('aria-label')) {
-                        hintStrs.push(`text="${element.getAttribute('aria-label')}"`)
-                    } else if (element.innerText) {
-                        hintStrs.push(`text="${element.innerText}"`)
-                    }
-                    switch (tagName) {
-                        case 'body':
-                        case 'html':
-                            continue;
-                        case 'select': {
-                            const name = element.getAttribute('name');
-                            const optionText = [];
-                            for (let i = 0; i < element.options.length; i++) {
-                                optionText.push(element.options[i].text);
-                            }
-                            const options = optionText.join(', ');
-                            if (name) {
-                                hintStrs.push(`name="${name}"`)
-                            }
-                            if (options) {
-                                hintStrs.push(`options="${options}"`)
-                            }
-                        }
-                        break;
-                        case 'input': {
-                            const type = element.getAttribute('type');
-                            const name = element.getAttribute('name');
-                            hintStrs.push(`inputType="${type ?? 'Unknown'}"`)
-                            if (name) {
-                                hintStrs.push(`name="${name}"`)
-                            }
-                        }
-                    }
-                    xPaths[hint.innerText] = hintStrs.join(' ');
-                }
-                return xPaths;
-            }
-            ''')
-
-    def get_x_path(self, shortcut) -> str:
-        return self.page.evaluate('''
-            (shortcut) => {
-                function findXPath(hintText) {
-                    const container = document.getElementById('vimiumHintMarkerContainer')
-                    if (!container) {
-                        return null
-                    }
-                    for (let i = 0; i < container.children.length; i++) {
-                        const hint = container.children[i]
-                        if (hint.innerText === hintText) {
-                            return hint.getAttribute('data-xpath')
-                        }
-                    }
-                }
-                
-                return findXPath(shortcut)
-            }            
-            ''', shortcut)
+        return {hint: details["description"] for hint, details in self.snapshot().items()}
+
+    def get_x_path(self, shortcut) -> str | None:
+        hint = self.snapshot().get(shortcut)
+        return hint["xpath"] if hint else None
 
     def get_current_url(self):
         return self.page.url
 
-    def capture(self, withVimBindings: bool = True):
+    def capture(self,
+                withVimBindings: bool = True,
+                width: int | None = None,
+                format: ScreenshotFormat = screenshot_format,
+                quality: int = screenshot_quality,
+                clip: dict | None = None) -> Screenshot:
         # capture a screenshot with vim bindings on the screen
         self.showHints(withVimBindings)
-        screenshot = Image.open(BytesIO(self.page.screenshot())).convert("RGB")
-        return screenshot
+        return self.screenshot(width, format, quality, clip)
+
+    def capture_content(self, width: int | None = None) -> Screenshot:
+        # just the main content of the page, without hints, at the scale a capture of the
+        # whole viewport at `width` would have
+        clip = self.call_hint_agent("contentRegion")
+        if not clip:
+            return self.screenshot(width)
+        viewport = self.page.viewport_size or {"width": 360, "height": 844}
+        scale = width / viewport["width"] if width else 1
+        return self.screenshot(round(clip["width"] * scale), clip=clip)
+
+    def capture_thumbnail(self, width: int) -> Screenshot:
+        # a small lossless capture of the page as it is, without activating the hints
+        return self.screenshot(width, "png")
+
+    def screenshot(self,
+                   width: int | None = None,
+                   format: ScreenshotFormat = screenshot_format,
+                   quality: int = screenshot_quality,
+                   clip: dict | None = None) -> Screenshot:
+        # ask chromium for the final encoding and size directly instead of
+        # decoding and re-encoding a PNG on our side
+        # `clip` is in viewport coordinates, like getBoundingClientRect
+        with span("browser.screenshot", format=format):
+            viewport = self.page.viewport_size or {"width": 360, "height": 844}
+            clip = clip or {"x": 0, "y": 0,
+                            "width": viewport["width"], "height": viewport["height"]}
+            scale = width / clip["width"] if width else 1
+            session = self.get_cdp_session()
+            params = {
+                "format": format,
+                "clip": {**page_clip(clip, session.send("Page.getLayoutMetrics")), "scale": scale},
+            }
+            if format != "png":
+                params["quality"] = quality
+            result = session.send("Page.captureScreenshot", params)
+            return Screenshot(
+                base64.b64decode(result["data"]),
+                format,
+                round(clip["width"] * scale),
+                round(clip["height"] * scale),
+            )
+
+    def get_cdp_session(self) -> CDPSession:
+        # clicks can move us to a new tab, sessions are per page
+        if not self.cdp_session or self.cdp_session[0] != self.page:
+            self.cdp_session = (
+                self.page, self.context.new_cdp_session(self.page))
+            if self.blocked_urls:
+                self.apply_blocked_urls(self.cdp_session[1])
+        return self.cdp_session[1]
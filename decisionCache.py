@@ -0,0 +1,106 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, List
+from urllib.parse import urlsplit
+
+from utils import normalize_text
+
+# actions that depend on more than the hints on screen (query_result reads the page
+# content) or that end the task before we can check they worked are never cached
+cacheable_actions = ("click", "navigate", "scroll")
+
+
+@dataclass
+class CachedDecision:
+    action: dict
+    tool_calls: List[Any]
+    created_at: float
+
+
+class DecisionCache:
+    """Remembers which action the model chose for a given screen and objective.
+
+    Entries expire after `ttl` seconds and the least recently used ones are evicted
+    once there are more than `max_entries`.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 3600, enabled: bool = True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self.entries: OrderedDict[str, CachedDecision] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def fingerprint(self, url: str, hints: dict[str, str] | None, objective: str, last_action: dict | None) -> str:
+        parts = urlsplit(url)
+        key = json.dumps({
+            # query strings and fragments are mostly tracking and scroll state
+            "url": f"{parts.scheme}://{parts.netloc}{parts.path}",
+            "hints": sorted((hints or {}).items()),
+            "objective": normalize_text(objective),
+            "last_action": normalize_action(last_action),
+        }, sort_keys=True)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> CachedDecision | None:
+        if not self.enabled:
+            return None
+        with self.lock:
+            decision = self.entries.get(key)
+            if decision and time.time() - decision.created_at > self.ttl:
+                del self.entries[key]
+                decision = None
+            if decision is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        # every use gets fresh tool call ids, a conversation may not repeat them
+        return CachedDecision(
+            decision.action.copy(),
+            [tool_call.model_copy(update={"id": f"call_{uuid.uuid4().hex}"})
+             for tool_call in decision.tool_calls],
+            decision.created_at,
+        )
+
+    def put(self, key: str, action: dict, tool_calls: List[Any]):
+        if not self.enabled or not is_cacheable(action):
+            return
+        with self.lock:
+            self.entries[key] = CachedDecision(action.copy(), tool_calls, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key: str):
+        # a cached action that turned out to do nothing must not be served again
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+            }
+
+
+def is_cacheable(action: dict) -> bool:
+    return any(key in action for key in cacheable_actions) and "query_result" not in action
+
+
+def normalize_action(action: dict | None):
+    if not action:
+        return None
+    return {key: value for key, value in action.items() if key not in ("description", "clicked_element")}
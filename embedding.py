@@ -1,13 +1,22 @@
+import atexit
 import os
 
-import openai
-
 from dotenv import load_dotenv
 from typing import List
 from utils import distances_from_embeddings, indices_of_nearest_neighbors_from_distances
+from embeddingCache import EmbeddingCache
+from llmClient import llm
+import telemetry
+from telemetry import span
 
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+embedding_model = "text-embedding-3-small"
+embedding_cache = EmbeddingCache(
+    os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite"),
+    max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")),
+)
+# when the memory hits were used, so the next run evicts the right entries
+atexit.register(embedding_cache.flush)
 
 
 def recommendations_from_strings(
@@ -28,8 +37,16 @@ def recommendations_from_strings(
 
 
 def get_embedding(str: str):
-    embedding = openai.embeddings.create(
-        input=str,
-        model="text-embedding-3-small",
-    )
-    return embedding.data[0].embedding
+    cached = embedding_cache.get(embedding_model, str)
+    telemetry.inc("vimbot_cache_lookups_total", "Cache lookups by cache and outcome",
+                  cache="embedding", outcome="hit" if cached is not None else "miss")
+    if cached is not None:
+        return cached
+    with span("llm.embed", model=embedding_model):
+        embedding = llm.embed(
+            input=str,
+            model=embedding_model,
+        )
+    result = embedding.data[0].embedding
+    embedding_cache.put(embedding_model, str, result)
+    return result
@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import List
+
+from utils import normalize_text
+
+
+class EmbeddingCache:
+    """LRU cache of embeddings keyed by (model, normalized text).
+
+    Recently used entries are kept in memory, everything else lives in a SQLite file
+    so the cache survives restarts. Both tiers evict the least recently used entries
+    once they grow past their size.
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, memory_entries: int = 1024, touch_batch: int = 64):
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory: OrderedDict[tuple[str, str], List[float]] = OrderedDict()
+        # when memory hits were last used, written to disk in batches so the disk LRU
+        # does not evict the entries that are used the most
+        self.touch_batch = touch_batch
+        self.touched: dict[tuple[str, str], float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text)
+            )''')
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.db.commit()
+        self.disk_entries = self.db.execute(
+            "SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get(self, model: str, text: str) -> List[float] | None:
+        key = (model, normalize_text(text))
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.touched[key] = time.time()
+                if len(self.touched) >= self.touch_batch:
+                    self._flush_touched()
+                    self.db.commit()
+                self.hits += 1
+                return self.memory[key]
+            row = self.db.execute(
+                "SELECT embedding FROM embeddings WHERE model = ? AND text = ?", key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text = ?", (time.time(), *key))
+            self.db.commit()
+            embedding = array("d", row[0]).tolist()
+            self._remember(key, embedding)
+            self.hits += 1
+            return embedding
+
+    def put(self, model: str, text: str, embedding: List[float]):
+        key = (model, normalize_text(text))
+        with self.lock:
+            self._remember(key, embedding)
+            row = (array("d", embedding).tobytes(), time.time(), *key)
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO embeddings (embedding, last_used, model, text) VALUES (?, ?, ?, ?)", row)
+            if cursor.rowcount:
+                self.disk_entries += 1
+            else:
+                self.db.execute(
+                    "UPDATE embeddings SET embedding = ?, last_used = ? WHERE model = ? AND text = ?", row)
+            if self.disk_entries > self.max_entries:
+                # the eviction has to see when the memory hits were used
+                self._flush_touched()
+                self.db.execute('''
+                    DELETE FROM embeddings WHERE rowid IN (
+                        SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?
+                    )''', (self.disk_entries - self.max_entries,))
+                self.disk_entries = self.db.execute(
+                    "SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self.db.commit()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "disk_entries": self.disk_entries,
+            }
+
+    def flush(self):
+        with self.lock:
+            self._flush_touched()
+            self.db.commit()
+
+    def _flush_touched(self):
+        if self.touched:
+            self.db.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND text = ?",
+                                [(last_used, *key) for key, last_used in self.touched.items()])
+            self.touched.clear()
+
+    def _remember(self, key: tuple[str, str], embedding: List[float]):
+        self.memory[key] = embedding
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            evicted, _ = self.memory.popitem(last=False)
+            last_used = self.touched.pop(evicted, None)
+            if last_used is not None:
+                self.db.execute("UPDATE embeddings SET last_used = ? WHERE model = ? AND text = ?",
+                                (last_used, *evicted))
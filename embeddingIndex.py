@@ -0,0 +1,107 @@
+import os
+import threading
+from io import BytesIO
+from typing import List, Sequence
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+
+def normalize_rows(embeddings) -> np.ndarray:
+    rows = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return rows / norms
+
+
+class EmbeddingIndex:
+    """Cosine similarity index over L2-normalized float32 rows.
+
+    Rows are persisted as a `.npy` file that is memory-mapped for reads and grown in
+    place when embeddings are appended.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.rows: np.ndarray | None = None
+        self._load()
+
+    def __len__(self):
+        return 0 if self.rows is None else self.rows.shape[0]
+
+    def rebuild(self, embeddings: Sequence[Sequence[float]]):
+        with self.lock:
+            if len(embeddings) == 0:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                self.rows = None
+                return
+            self._replace(normalize_rows(embeddings))
+
+    def append(self, embedding: Sequence[float]):
+        row = normalize_rows(embedding)
+        with self.lock:
+            if self.rows is None:
+                self._replace(row)
+                return
+            if row.shape[1] != self.rows.shape[1]:
+                raise ValueError(
+                    f"Expected an embedding of size {self.rows.shape[1]}, got {row.shape[1]}")
+            existing = self.rows
+            header = BytesIO()
+            npy_format.write_array_header_1_0(header, {
+                "descr": npy_format.dtype_to_descr(existing.dtype),
+                "fortran_order": False,
+                "shape": (existing.shape[0] + 1, existing.shape[1]),
+            })
+            # drop the mapping before touching the file underneath it
+            self.rows = None
+            with open(self.path, "r+b") as f:
+                npy_format.read_magic(f)
+                npy_format.read_array_header_1_0(f)
+                if f.tell() == len(header.getvalue()):
+                    # the row before the header, a reader never sees a row that is not there
+                    f.seek(0, os.SEEK_END)
+                    f.write(row.tobytes())
+                    f.flush()
+                    f.seek(0)
+                    f.write(header.getvalue())
+                    grown = True
+                else:
+                    grown = False
+            if not grown:
+                # the header has no room left to grow, write the whole array again
+                self._replace(np.concatenate([existing, row]))
+            self._load()
+
+    def search(self, query: Sequence[float], k: int = 1, max_distance: float = 0.5) -> List[int]:
+        """Return the indices of up to k rows within max_distance (cosine), nearest first."""
+        rows = self.rows
+        if rows is None or k <= 0:
+            return []
+        distances = 1 - rows @ normalize_rows(query)[0]
+        candidates = np.flatnonzero(distances <= max_distance)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(
+                distances[candidates], k - 1)[:k]]
+        return candidates[np.argsort(distances[candidates], kind="stable")].tolist()
+
+    def reload(self):
+        # pick up rows another process added to the file
+        with self.lock:
+            self._load()
+
+    def _replace(self, rows: np.ndarray):
+        # a new file, so other processes keep reading the old one until they reload
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, rows)
+        os.replace(tmp_path, self.path)
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.path):
+            self.rows = np.load(self.path, mmap_mode="r")
+        else:
+            self.rows = None
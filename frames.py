@@ -0,0 +1,55 @@
+import os
+import time
+from dataclasses import dataclass
+
+from PIL import Image, ImageChops
+
+from screenshot import Screenshot
+
+frame_width = 64
+# a pixel only counts as changed when it moved more than this many grey levels
+pixel_tolerance = 16
+# below this fraction of changed pixels two frames are considered the same
+change_threshold = float(os.getenv("FRAME_CHANGE_THRESHOLD", "0.002"))
+stable_timeout = float(os.getenv("FRAME_STABLE_TIMEOUT", "3"))
+
+
+@dataclass
+class Frame:
+    """A tiny greyscale thumbnail of the page, cheap to capture and to compare."""
+    image: Image.Image
+
+    @classmethod
+    def from_screenshot(cls, screenshot: Screenshot):
+        return cls(screenshot.image().convert("L"))
+
+    def difference(self, other: "Frame") -> float:
+        """Return the fraction of pixels that changed between the two frames."""
+        if self.image.size != other.image.size:
+            return 1.0
+        histogram = ImageChops.difference(self.image, other.image).histogram()
+        width, height = self.image.size
+        return sum(histogram[pixel_tolerance + 1:]) / (width * height)
+
+    def same_as(self, other: "Frame | None") -> bool:
+        return other is not None and self.difference(other) < change_threshold
+
+
+def capture_frame(driver) -> Frame:
+    return Frame.from_screenshot(driver.capture_thumbnail(frame_width))
+
+
+def wait_for_stable_frame(driver, timeout: float = stable_timeout, interval: float = 0.1) -> tuple[Frame, bool]:
+    """Capture frames until two consecutive ones match or the timeout runs out.
+
+    Returns the last frame and whether the page settled in time.
+    """
+    deadline = time.monotonic() + timeout
+    previous = capture_frame(driver)
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        current = capture_frame(driver)
+        if current.same_as(previous):
+            return current, True
+        previous = current
+    return previous, False
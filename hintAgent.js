@@ -0,0 +1,152 @@
+// Installed into every page as an init script. Collects everything we need to know
+// about the vimium hints in a single round trip.
+(() => {
+    if (window.__vimbot) {
+        return;
+    }
+
+    function elementForXPath(xpath) {
+        const result = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null);
+        return result ? result.singleNodeValue : null;
+    }
+
+    function describe(element) {
+        const tagName = element.tagName.toLowerCase();
+        let hintStrs = [];
+        if (tagName) {
+            hintStrs.push(`type="${tagName}"`);
+        }
+        if (element.getAttribute('aria-label')) {
+            hintStrs.push(`text="${element.getAttribute('aria-label')}"`);
+        } else if (element.innerText) {
+            hintStrs.push(`text="${element.innerText}"`);
+        }
+        switch (tagName) {
+            case 'select': {
+                const name = element.getAttribute('name');
+                const optionText = [];
+                for (let i = 0; i < element.options.length; i++) {
+                    optionText.push(element.options[i].text);
+                }
+                const options = optionText.join(', ');
+                if (name) {
+                    hintStrs.push(`name="${name}"`);
+                }
+                if (options) {
+                    hintStrs.push(`options="${options}"`);
+                }
+            }
+                break;
+            case 'input': {
+                const type = element.getAttribute('type');
+                const name = element.getAttribute('name');
+                hintStrs.push(`inputType="${type ?? 'Unknown'}"`);
+                if (name) {
+                    hintStrs.push(`name="${name}"`);
+                }
+            }
+        }
+        return hintStrs.join(' ');
+    }
+
+    function isUnique(selector) {
+        try {
+            return document.querySelectorAll(selector).length === 1;
+        } catch (e) {
+            return false;
+        }
+    }
+
+    // ids and classes with long digit runs are usually generated and change between sessions
+    function looksGenerated(value) {
+        return /\d{3,}|^[a-z0-9]{12,}$/i.test(value);
+    }
+
+    function stableSelector(element) {
+        if (window.playwright) {
+            // available when running with PWDEBUG=1, playwright knows best
+            return window.playwright.selector(element);
+        }
+        const parts = [];
+        let current = element;
+        while (current && current.nodeType === Node.ELEMENT_NODE && current !== document.documentElement) {
+            const tagName = current.tagName.toLowerCase();
+            if (current.id && !looksGenerated(current.id)) {
+                parts.unshift(`#${CSS.escape(current.id)}`);
+                break;
+            }
+            let part = tagName;
+            for (const attribute of ['data-testid', 'aria-label', 'name', 'placeholder']) {
+                const value = current.getAttribute(attribute);
+                if (value && !looksGenerated(value)) {
+                    part = `${tagName}[${attribute}="${CSS.escape(value)}"]`;
+                    break;
+                }
+            }
+            if (isUnique([part, ...parts].join(' > '))) {
+                parts.unshift(part);
+                break;
+            }
+            const parent = current.parentElement;
+            if (parent) {
+                const siblings = Array.from(parent.children).filter((child) => child.tagName === current.tagName);
+                if (siblings.length > 1) {
+                    part += `:nth-of-type(${siblings.indexOf(current) + 1})`;
+                }
+            }
+            parts.unshift(part);
+            current = parent;
+        }
+        return parts.join(' > ');
+    }
+
+    function snapshot() {
+        const container = document.getElementById('vimiumHintMarkerContainer');
+        if (!container) {
+            return null;
+        }
+        const hints = {};
+        for (let i = 0; i < container.children.length; i++) {
+            const hint = container.children[i];
+            const xpath = hint.getAttribute('data-xpath');
+            if (!xpath) {
+                continue;
+            }
+            const element = elementForXPath(xpath);
+            if (!element) {
+                continue;
+            }
+            const tagName = element.tagName.toLowerCase();
+            if (tagName === 'body' || tagName === 'html') {
+                continue;
+            }
+            hints[hint.innerText] = {
+                xpath,
+                description: describe(element),
+                selector: stableSelector(element),
+            };
+        }
+        return hints;
+    }
+
+    // the visible part of the page's main content, to crop screenshots that are only read
+    function contentRegion() {
+        for (const selector of ['main', '[role="main"]', '#content', 'article']) {
+            const element = document.querySelector(selector);
+            if (!element) {
+                continue;
+            }
+            const rect = element.getBoundingClientRect();
+            const x = Math.max(0, rect.left);
+            const y = Math.max(0, rect.top);
+            const width = Math.min(window.innerWidth, rect.right) - x;
+            const height = Math.min(window.innerHeight, rect.bottom) - y;
+            if (width >= 100 && height >= 100) {
+                return { x, y, width, height };
+            }
+        }
+        return null;
+    }
+
+    window.__vimbot = { snapshot, stableSelector, contentRegion };
+})();
@@ -0,0 +1,246 @@
+import queue
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Any, Callable, ContextManager, Dict, List, Literal
+
+JobStatus = Literal["queued", "running", "succeeded", "failed", "cancelled"]
+
+_local = threading.local()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    prompt: str
+    completion_condition: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: JobStatus = "queued"
+    result: Any = None
+    error: str | None = None
+    worker: int | None = None
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    cancel_event: threading.Event = field(
+        default_factory=threading.Event, repr=False)
+    # progress events for a client that streams the job, None when nobody listens
+    events: queue.Queue[dict] | None = field(default=None, repr=False)
+    # anything else the handler needs, e.g. the objectives of a batch
+    params: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def finished(self):
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "worker": self.worker,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """Runs jobs on a fixed set of worker threads.
+
+    `setup(worker_index)` is entered on the worker thread before it takes any job, so
+    each worker can own thread-bound resources such as its own browser. A worker whose
+    setup fails is started again after `restart_delay` seconds, doubling up to
+    `max_restart_delay`. While every worker is down, queued and new jobs fail right away.
+    """
+
+    def __init__(self,
+                 handler: Callable[[Job], Any],
+                 num_workers: int = 1,
+                 setup: Callable[[int], ContextManager] | None = None,
+                 job_ttl: float = 3600,
+                 name: str = "worker",
+                 restart_delay: float = 5,
+                 max_restart_delay: float = 300):
+        self.handler = handler
+        self.num_workers = num_workers
+        self.setup = setup or (lambda index: nullcontext())
+        self.job_ttl = job_ttl
+        self.name = name
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.jobs: Dict[str, Job] = {}
+        self.pending: queue.Queue[Job | None] = queue.Queue()
+        self.lock = threading.Lock()
+        self.workers: List[threading.Thread] = []
+        self.stopping = threading.Event()
+        self.alive: set[int] = set()
+        # why each worker that is down stopped
+        self.dead: Dict[int, str] = {}
+
+    def start(self):
+        self.stopping.clear()
+        for index in range(self.num_workers):
+            worker = threading.Thread(
+                target=self._work, args=(index,), name=f"vimbot-{self.name}-{index}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        for _ in self.workers:
+            self.pending.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def submit(self, prompt: str, completion_condition: str, stream: bool = False,
+               params: Dict[str, Any] | None = None) -> Job:
+        job = Job(prompt, completion_condition, events=queue.Queue() if stream else None,
+                  params=params or {})
+        with self.lock:
+            self._prune()
+            self.jobs[job.id] = job
+            if self._all_dead():
+                # nobody would ever pick it up
+                job.error = self._dead_error()
+                self._finish(job, "failed")
+                return job
+        self.pending.put(job)
+        return job
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.num_workers,
+                "alive": len(self.alive),
+                "dead": dict(self.dead),
+                "queued": sum(1 for job in self.jobs.values() if job.status == "queued"),
+                "running": sum(1 for job in self.jobs.values() if job.status == "running"),
+            }
+
+    def get(self, job_id: str) -> Job | None:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Job | None:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if not job or job.finished:
+                return job
+            job.cancel_event.set()
+            if job.status == "queued":
+                # never picked up, the worker will skip it
+                self._finish(job, "cancelled")
+        return job
+
+    def _work(self, index: int):
+        delay = self.restart_delay
+        while not self.stopping.is_set():
+            try:
+                with self.setup(index):
+                    with self.lock:
+                        self.alive.add(index)
+                        self.dead.pop(index, None)
+                    delay = self.restart_delay
+                    try:
+                        self._serve(index)
+                        return
+                    finally:
+                        with self.lock:
+                            self.alive.discard(index)
+            except Exception as e:
+                print(f"Worker {index} stopped unexpectedly, restarting it in {delay:.0f}s")
+                traceback.print_exc()
+                self._worker_died(index, e)
+            if self.stopping.wait(delay):
+                return
+            delay = min(delay * 2, self.max_restart_delay)
+
+    def _serve(self, index: int):
+        while True:
+            job = self.pending.get()
+            if job is None:
+                return
+            with self.lock:
+                if job.status != "queued":
+                    continue
+                job.status = "running"
+                job.worker = index
+                job.started_at = time.time()
+            self._run(job)
+
+    def _worker_died(self, index: int, error: Exception):
+        with self.lock:
+            self.dead[index] = f"{type(error).__name__}: {error}"
+            if not self._all_dead():
+                return
+            # the jobs would wait for a worker that may never come back
+            for job in self.jobs.values():
+                if job.status == "queued":
+                    job.error = self._dead_error()
+                    self._finish(job, "failed")
+
+    def _all_dead(self) -> bool:
+        return len(self.dead) >= self.num_workers
+
+    def _dead_error(self) -> str:
+        return f"No {self.name} is running: {'; '.join(sorted(set(self.dead.values())))}"
+
+    def _run(self, job: Job):
+        with current_job(job):
+            try:
+                result = self.handler(job)
+                status, error = "succeeded", None
+            except JobCancelled:
+                result, status, error = None, "cancelled", None
+            except Exception as e:
+                traceback.print_exc()
+                result, status, error = None, "failed", str(e)
+        with self.lock:
+            job.result = result
+            job.error = error
+            self._finish(job, status)
+
+    def _finish(self, job: Job, status: JobStatus):
+        job.status = status
+        job.finished_at = time.time()
+        if job.events is not None:
+            job.events.put({"event": "result", "data": {**job.to_dict(), "result": job.result}})
+
+    def _prune(self):
+        cutoff = time.time() - self.job_ttl
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished and job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+
+@contextmanager
+def current_job(job: Job):
+    _local.job = job
+    try:
+        yield job
+    finally:
+        _local.job = None
+
+
+def emit_event(event: str, data: dict):
+    # progress of the current job, for clients that stream it
+    job: Job | None = getattr(_local, "job", None)
+    if job and job.events is not None:
+        job.events.put({"event": event, "data": data})
+
+
+def raise_if_cancelled():
+    # called between steps so a cancelled job stops at the next safe point
+    job: Job | None = getattr(_local, "job", None)
+    if job and job.cancel_event.is_set():
+        raise JobCancelled(f"Job {job.id} was cancelled")
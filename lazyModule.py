@@ -0,0 +1,22 @@
+import importlib
+
+
+class LazyModule:
+    """Stands in for a module and imports it the first time one of its attributes is used.
+
+    Keeps heavy dependencies (openai, playwright, PIL, numpy) out of startup for the modes
+    that never need them.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute: str):
+        if self._module is None:
+            # the import system serializes threads importing the same module
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}{'' if self._module is None else ' (loaded)'}>"
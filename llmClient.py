@@ -0,0 +1,190 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable
+
+import httpx
+import openai
+from dotenv import load_dotenv
+
+import telemetry
+
+load_dotenv()
+
+# errors worth another attempt, anything else (bad request, auth, ...) fails right away
+retriable_errors = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class LLMClient:
+    """Shared OpenAI client with connection pooling, deadlines, retries and a concurrency limit.
+
+    Every call gets a deadline that covers all of its attempts. Retriable errors are retried
+    with jittered exponential backoff, and a rate limit response pauses all callers until the
+    time the server asked for has passed.
+    """
+
+    def __init__(self,
+                 api_key: str | None = None,
+                 base_url: str | None = None,
+                 timeout: float = 60,
+                 max_retries: int = 4,
+                 max_concurrency: int = 8,
+                 max_connections: int = 20,
+                 backoff: float = 0.5,
+                 max_backoff: float = 20):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        self.limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.client: openai.OpenAI | None = None
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.rate_limited_until = 0.0
+        self.calls = 0
+        self.retries = 0
+        # asyncio primitives belong to one event loop, so the async side is per loop
+        self.async_clients: dict[asyncio.AbstractEventLoop,
+                                 tuple[openai.AsyncOpenAI, asyncio.Semaphore]] = {}
+
+    def chat(self, deadline: float | None = None, **kwargs):
+        return self.call(self.sync_client().chat.completions.create, deadline, **kwargs)
+
+    def embed(self, deadline: float | None = None, **kwargs):
+        return self.call(self.sync_client().embeddings.create, deadline, **kwargs)
+
+    def call(self, create: Callable[..., Any], deadline: float | None = None, **kwargs):
+        expires_at = time.monotonic() + (deadline or self.timeout)
+        attempt = 0
+        while True:
+            pause = self.rate_limited_until - time.monotonic()
+            if pause > 0:
+                time.sleep(min(pause, max(0, expires_at - time.monotonic())))
+            remaining = self.remaining(expires_at)
+            try:
+                with self.semaphore:
+                    self.count_call(attempt)
+                    return create(**kwargs, timeout=remaining)
+            except retriable_errors as e:
+                delay = self.retry_delay(attempt, e, expires_at)
+            print(f"Retrying the OpenAI call in {delay:.1f}s...")
+            time.sleep(delay)
+            attempt += 1
+
+    async def achat(self, deadline: float | None = None, **kwargs):
+        client, _ = self.async_client()
+        return await self.acall(client.chat.completions.create, deadline, **kwargs)
+
+    async def aembed(self, deadline: float | None = None, **kwargs):
+        client, _ = self.async_client()
+        return await self.acall(client.embeddings.create, deadline, **kwargs)
+
+    async def acall(self, create: Callable[..., Awaitable[Any]], deadline: float | None = None, **kwargs):
+        _, semaphore = self.async_client()
+        expires_at = time.monotonic() + (deadline or self.timeout)
+        attempt = 0
+        while True:
+            pause = self.rate_limited_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(min(pause, max(0, expires_at - time.monotonic())))
+            remaining = self.remaining(expires_at)
+            try:
+                async with semaphore:
+                    self.count_call(attempt)
+                    return await create(**kwargs, timeout=remaining)
+            except retriable_errors as e:
+                delay = self.retry_delay(attempt, e, expires_at)
+            print(f"Retrying the OpenAI call in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def sync_client(self) -> openai.OpenAI:
+        # created on first use, so importing this module does not require an API key
+        with self.lock:
+            if self.client is None:
+                self.client = openai.OpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    max_retries=0,
+                    http_client=httpx.Client(
+                        limits=self.limits, timeout=self.timeout),
+                )
+            return self.client
+
+    def async_client(self) -> tuple[openai.AsyncOpenAI, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if loop not in self.async_clients:
+                self.async_clients[loop] = (
+                    openai.AsyncOpenAI(
+                        api_key=self.api_key,
+                        base_url=self.base_url,
+                        max_retries=0,
+                        http_client=httpx.AsyncClient(
+                            limits=self.limits, timeout=self.timeout),
+                    ),
+                    asyncio.Semaphore(self.max_concurrency),
+                )
+            return self.async_clients[loop]
+
+    def remaining(self, expires_at: float) -> float:
+        remaining = expires_at - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("The OpenAI call did not finish before its deadline")
+        return remaining
+
+    def count_call(self, attempt: int):
+        with self.lock:
+            self.calls += 1
+            if attempt:
+                self.retries += 1
+        telemetry.inc("vimbot_llm_calls_total", "Requests sent to the OpenAI API, retries included")
+        if attempt:
+            telemetry.inc("vimbot_llm_retries_total", "Retried requests to the OpenAI API")
+
+    def retry_delay(self, attempt: int, error: Exception, expires_at: float) -> float:
+        retry_after = None
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                pass
+        delay = retry_after if retry_after is not None else \
+            random.uniform(0.5, 1) * min(self.max_backoff, self.backoff * 2 ** attempt)
+        if isinstance(error, openai.RateLimitError):
+            with self.lock:
+                self.rate_limited_until = max(
+                    self.rate_limited_until, time.monotonic() + delay)
+        if attempt >= self.max_retries or time.monotonic() + delay >= expires_at:
+            raise error
+        return delay
+
+    def stats(self):
+        with self.lock:
+            return {"calls": self.calls, "retries": self.retries}
+
+
+llm = LLMClient(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    # point this at a local stand-in to run without the real API
+    base_url=os.getenv("OPENAI_BASE_URL") or None,
+    timeout=float(os.getenv("OPENAI_TIMEOUT", "60")),
+    max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "4")),
+    max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "8")),
+)
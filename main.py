@@ -1,149 +1,465 @@
+from __future__ import annotations
+
 import argparse
+import queue
+import threading
 import time
 import os
-
-import perception
-from embedding import get_embedding, recommendations_from_strings
-from browserAgent import BrowserAgent
-
-from flask import Flask, request
-from typing import Literal, Union, List
+import uuid
+
+from lazyModule import LazyModule
+from playbookTemplate import extract_template, fill_template
+from utils import normalize_text
+from agentPool import AgentPool, current_pool, set_current_pool
+from jobs import Job, JobQueue, emit_event, raise_if_cancelled
+from decisionCache import DecisionCache
+from stepPipeline import StepTimings, background, run_in_background, summarize_timings
+from sessionState import SessionStore
+import telemetry
+from telemetry import trace_task
+
+from typing import TYPE_CHECKING, Literal, Union, List
+from contextlib import contextmanager
 import json
 
+# openai, playwright, PIL and numpy are only imported once a mode needs them, so the
+# server and maintenance commands like --reset start quickly
+perception = LazyModule("perception")
+batchReplay = LazyModule("batchReplay")
+embedding = LazyModule("embedding")
+browserAgent = LazyModule("browserAgent")
+frames = LazyModule("frames")
+playbookCompiler = LazyModule("playbookCompiler")
+replayCheckpoints = LazyModule("replayCheckpoints")
+
+if TYPE_CHECKING:
+    from browserAgent import BrowserAgent
+    from frames import Frame
+    from playbookStore import PlaybookStore
+
 from dotenv import load_dotenv
 
 load_dotenv()
 is_playbook_recording_enabled = os.getenv("PWDEBUG", "0") == "1"
-
-
-def do_image_reasoning_work(website: Union[Literal['todoist'], str], objective: str, completion_condition: str = "When the objective seems complete"):
-    driver = get_driver(website)
-    input("Press Enter to continue...")
-    history: List[str] = []
+todoist_url = os.getenv("TODOIST_URL", "https://app.todoist.com")
+# the classic flow waits for a key press before it starts, so the browser can be inspected
+confirm_start = os.getenv("CONFIRM_START", "1") == "1"
+# requests todoist makes to save changes, closing the browser before they finish loses them
+todoist_save_url_pattern = os.getenv(
+    "TODOIST_SAVE_URL_PATTERN", r"/api/v[\d.]+/(sync|tasks)")
+playbook_store_file = "playbooks.sqlite"
+legacy_playbook_record_file = "playbook_record.json"
+batch_concurrency = int(os.getenv("BATCH_CONCURRENCY", "4"))
+# the most tabs a single batch may ask for
+batch_max_concurrency = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+# replays click recorded selectors, nobody needs to watch them
+replay_headless = os.getenv("REPLAY_HEADLESS", "1") == "1"
+# replay recorded selectors as a compiled plan instead of one action at a time
+compile_playbooks = os.getenv("COMPILE_PLAYBOOKS", "1") == "1"
+# seconds between keep-alive comments on a quiet event stream
+stream_heartbeat = float(os.getenv("STREAM_HEARTBEAT", "10"))
+# steps of a replay the model may take over before it gets the rest of the task
+replay_max_handoffs = int(os.getenv("REPLAY_MAX_HANDOFFS", "2"))
+# the todoist login, browsers start from it instead of a copy of a logged in profile
+session_store = SessionStore(
+    os.getenv("SESSION_STATE_PATH", "session_state.json"),
+    max_age=float(os.getenv("SESSION_MAX_AGE_HOURS", "168")) * 3600,
+)
+session_probe_timeout = float(os.getenv("SESSION_PROBE_TIMEOUT", "15")) * 1000
+session_lock = threading.Lock()
+decision_cache = DecisionCache(
+    max_entries=int(os.getenv("DECISION_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("DECISION_CACHE_TTL", "3600")),
+    enabled=os.getenv("DECISION_CACHE", "1") == "1",
+)
+
+
+def do_image_reasoning_work(website: Union[Literal['todoist'], str], objective: str, completion_condition: str = "When the objective seems complete",
+                            driver: BrowserAgent | None = None,
+                            history: List | None = None,
+                            first_note: str | None = None,
+                            max_steps: int | None = None):
+    # a replay hands over its driver and what it did so far, then keeps both
+    owns_driver = driver is None
+    if driver is None:
+        driver = get_driver(website)
+        if confirm_start:
+            input("Press Enter to continue...")
+    history = [] if history is None else history
     playbook_steps = []
+    usage_log: List[perception.StepUsage] = []
     result = None
-    while True:
-        time.sleep(1)
-        print("Capturing the screen...")
-        screenshot = driver.capture()
-        action_hints = driver.get_x_paths_for_all_hints()
-        print("Getting actions for the given objective...")
-        current_url = driver.get_current_url()
-        action = perception.get_actions(
-            screenshot, objective, completion_condition, current_url, action_hints, history)
-        addPlaybookStep(driver, action, playbook_steps)
-        perform_action_result = driver.perform_action(action)
-        if perform_action_result:
-            result = perform_action_result
-            break
-    savePlaybook(playbook_steps, objective)
-    close_driver(driver)
+    # the frame right before the last action, to tell whether the action did anything
+    action: dict | None = None
+    frame_before_action: Frame | None = None
+    retried = False
+    # a decision from the model is only cached once we saw that it changed the page
+    pending_decision: tuple[str, dict, list] | None = None
+    # the cache entry the last action came from, dropped if it turns out to do nothing
+    served_decision: str | None = None
+    # cached decisions never reach the model's step limit, so the loop enforces it
+    step_limit = perception.default_context_policy.max_steps
+    step_timings: List[dict] = []
+    # the last screen missed the decision cache, so the next one most likely needs a screenshot too
+    expect_miss = True
+    try:
+        while True:
+            raise_if_cancelled()
+            # the history holds the objective and then one entry per step
+            if step_limit is not None and len(history) > step_limit:
+                raise perception.StepLimitExceeded(
+                    f"Giving up after {step_limit} steps without completing the objective")
+            timings = StepTimings()
+            with timings.stage("settle"):
+                driver.wait_until_ready()
+                frame, _ = frames.wait_for_stable_frame(driver)
+            note = None
+            if action and can_have_no_effect(action) and frame.same_as(frame_before_action):
+                if "click" in action and not retried:
+                    print("The last action did not change the page, retrying it...")
+                    retried = True
+                    driver.wait_for_hints()
+                    driver.perform_action(action)
+                    continue
+                print("The last action did not change the page, flagging it...")
+                note = "The previous action did not visibly change the page. Try something else."
+                if served_decision:
+                    decision_cache.delete(served_decision)
+            elif first_note:
+                note, first_note = first_note, None
+            elif pending_decision:
+                decision_cache.put(*pending_decision)
+            pending_decision = None
+            served_decision = None
+            retried = False
+            encoded_screenshot = None
+            with timings.stage("hints"):
+                driver.wait_for_hints()
+            if (expect_miss or note) and perception.perception_mode != "text-first":
+                # capture first, so the image is encoded while we read the hints
+                encoded_screenshot = capture_screen(driver, timings)
+            with timings.stage("observe"):
+                action_hints = driver.get_x_paths_for_all_hints()
+                current_url = driver.get_current_url()
+            decision_key = decision_cache.fingerprint(
+                current_url, action_hints, objective, action)
+            cached_decision = decision_cache.get(decision_key) if not note else None
+            if not note:
+                telemetry.inc("vimbot_cache_lookups_total", "Cache lookups by cache and outcome",
+                              cache="decision", outcome="hit" if cached_decision else "miss")
+            expect_miss = cached_decision is None
+            if cached_decision:
+                print("Reusing the action chosen for this screen before...")
+                action = cached_decision.action
+                served_decision = decision_key
+                perception.append_to_history(
+                    history, cached_decision.tool_calls, objective, completion_condition, current_url, action_hints)
+            else:
+                action = None
+                if perception.perception_mode == "text-first":
+                    print("Getting actions from the hint descriptions...")
+                    with timings.stage("decide_text"):
+                        action = perception.get_actions_from_text(
+                            objective, completion_condition, current_url, action_hints, history, note,
+                            usage_log=usage_log)
+                if action is None:
+                    screenshot = (encoded_screenshot or capture_screen(driver, timings)).result()
+                    print("Getting actions for the given objective...")
+                    with timings.stage("decide"):
+                        action = perception.get_actions(
+                            screenshot, objective, completion_condition, current_url, action_hints, history, note,
+                            usage_log=usage_log)
+                if usage_log:
+                    print(f"Step usage: {usage_log[-1]}")
+                pending_decision = (decision_key, action, history[-1])
+            with timings.stage("record"):
+                addPlaybookStep(driver, action, playbook_steps)
+            frame_before_action = frame
+            with timings.stage("act"):
+                perform_action_result = driver.perform_action(action)
+            step_timings.append(timings.report())
+            print(f"Step timings: {step_timings[-1]}")
+            emit_step(action, current_url, mode="reasoning", timings=step_timings[-1])
+            telemetry.inc("vimbot_steps_total", "Steps taken", mode="reasoning")
+            if perform_action_result:
+                result = perform_action_result
+                break
+            if max_steps is not None and len(step_timings) >= max_steps:
+                break
+        # without PWDEBUG nothing is recorded, an empty playbook would match this objective
+        # exactly and replay nothing
+        if owns_driver and playbook_steps:
+            # the caller does not need to wait for the embedding and the write
+            background.defer(savePlaybook, playbook_steps, objective)
+    finally:
+        print(f"Task usage: {perception.summarize_usage(usage_log)}")
+        print(f"Task timings: {summarize_timings(step_timings)}")
+        observe_task_steps("reasoning", len(step_timings))
+        print(f"Decision cache: {decision_cache.stats()}")
+        if owns_driver:
+            # always hand the driver back, a pooled agent would leak otherwise
+            close_driver(driver)
     return result
 
 
+def capture_screen(driver: BrowserAgent, timings: StepTimings):
+    print("Capturing the screen...")
+    with timings.stage("capture"):
+        screenshot = driver.screenshot(width=perception.IMG_RES)
+    return run_in_background(timings, "encode", perception.image_attempts, screenshot)
+
+
+def can_have_no_effect(action: dict):
+    # typing or navigating always changes something, clicks and scrolls may do nothing
+    return ("click" in action and "type" not in action) or "scroll" in action
+
+
 def replay_history(website: Union[Literal['todoist'], Literal['google']], objective: str, completion_condition):
     playbook = get_playbook(objective)
     if not playbook:
         return do_image_reasoning_work(website, objective, completion_condition)
-    with open(playbook['playbookFile'], "r") as f:
-        playbook_record = json.load(f)
-    adjusted_playbook = perception.adjust_playbook(
-        playbook_record, playbook['objective'], objective)
-    driver = get_driver(website)
+    adjusted_playbook = adjust_playbook(playbook, objective)
+    if not adjusted_playbook:
+        print("The playbook has no steps to replay, starting a reasoning run...")
+        return do_image_reasoning_work(website, objective, completion_condition)
+    driver = get_driver(website, headless=replay_headless)
     result = None
     print("Adjusted playbook: ", adjusted_playbook)
-    for action in adjusted_playbook:
-        if "query_result" in action:
-            # wait for the page to be visible before taking a screenshot
-            time.sleep(1)
-            screenshot = driver.capture(False)
-            action = perception.query_screenshot(
-                screenshot=screenshot, objective=objective)
-        result = driver.perform_action(action)
-    close_driver(driver)
+    steps = 0
+    # what was replayed so far, as history for the model when it has to take over a step
+    history: List = []
+    replayed: List[dict] = []
+    handoffs = 0
+    try:
+        # images, fonts and analytics are not needed to click recorded selectors
+        driver.block_resources()
+        index = 0
+        plan = playbookCompiler.compile_playbook(adjusted_playbook) if compile_playbooks else None
+        if plan and plan.steps:
+            start = time.perf_counter()
+
+            def on_plan_step(step: playbookCompiler.PlanStep):
+                # a compiled step may replay several playbook steps at once
+                for action in adjusted_playbook[step.index:step.index + step.covers]:
+                    emit_step(action, driver.get_current_url(), mode="replay", compiled=True)
+
+            index = playbookCompiler.run_plan(driver, plan, on_step=on_plan_step)
+            if index:
+                print(f"Replayed {index} playbook steps as compiled steps "
+                      f"in {time.perf_counter() - start:.2f}s")
+                replayed.extend(adjusted_playbook[:index])
+                steps += index
+                telemetry.inc("vimbot_steps_total", "Steps taken", index, mode="replay")
+        while index < len(adjusted_playbook):
+            raise_if_cancelled()
+            action = adjusted_playbook[index]
+            if "query_result" in action:
+                # the model reads this page, so it gets everything that was blocked
+                driver.unblock_resources()
+                # wait for the page to be visible before taking a screenshot
+                driver.wait_until_ready()
+                screenshot = driver.capture_content(width=perception.IMG_RES)
+                action = perception.query_screenshot(
+                    screenshot=screenshot, objective=objective)
+            elif "done" not in action:
+                try:
+                    action = replayCheckpoints.resolve_step(driver, action)
+                except replayCheckpoints.ReplayDivergence as divergence:
+                    add_replayed_steps(history, replayed, objective, completion_condition, driver.get_current_url())
+                    replayed = []
+                    handoffs += 1
+                    telemetry.inc("vimbot_replay_handoffs_total", "Replay steps handed over to the model")
+                    note = (f"A recorded playbook was replayed up to here, but its next step ({describe_step(action)}) "
+                            f"does not fit this page: {divergence}. Take the action that gets the objective there.")
+                    # the model decides from a screenshot, which needs the images and fonts
+                    driver.unblock_resources()
+                    if handoffs > replay_max_handoffs:
+                        print("The replay left the recorded path too often, handing the rest of the task to the model...")
+                        result = do_image_reasoning_work(
+                            website, objective, completion_condition, driver=driver, history=history, first_note=note)
+                        break
+                    print(f"Playbook step {index + 1} does not fit the page ({divergence}), asking the model for it...")
+                    result = do_image_reasoning_work(
+                        website, objective, completion_condition, driver=driver, history=history, first_note=note,
+                        max_steps=1)
+                    if result:
+                        break
+                    driver.block_resources()
+                    # the model may only have cleared the way (e.g. closed a dialog), then the recorded step fits again
+                    try:
+                        action = replayCheckpoints.resolve_step(driver, action)
+                    except replayCheckpoints.ReplayDivergence:
+                        index += 1
+                        continue
+            result = driver.perform_action(action)
+            replayed.append(action)
+            emit_step(action, driver.get_current_url(), mode="replay")
+            steps += 1
+            telemetry.inc("vimbot_steps_total", "Steps taken", mode="replay")
+            index += 1
+    finally:
+        observe_task_steps("replay", steps)
+        close_driver(driver)
     return result
 
 
+def emit_step(action: dict, url: str, **details):
+    # for clients streaming the job, results of the model reading the page are sent right away
+    action = {key: value for key, value in action.items() if key != "checkpoint"}
+    emit_event("step", {"action": action, "url": url, **details})
+    if "query_result" in action:
+        emit_event("query_result", action)
+
+
+def describe_step(action: dict) -> str:
+    return action.get("description") or json.dumps(
+        {key: value for key, value in action.items() if key not in ("checkpoint", "clicked_element")})
+
+
+def add_replayed_steps(history: List, actions: List[dict], objective: str, completion_condition: str, current_url: str):
+    for action in actions:
+        perception.append_to_history(
+            history, perception.tool_calls_for_action(action), objective, completion_condition, current_url, {})
+
+
+def observe_task_steps(mode: str, steps: int):
+    telemetry.observe("vimbot_task_steps", "Steps per task", steps,
+                      buckets=(1, 2, 5, 10, 20, 30, 50), mode=mode)
+
+
+def replay_batch(objectives: List[str], concurrency: int = batch_concurrency):
+    import asyncio
+
+    start = time.perf_counter()
+    results = asyncio.run(batchReplay.run_batch(
+        objectives,
+        resolve_playbook_steps,
+        todoist_url,
+        'button[aria-controls="sidebar"]',
+        concurrency=concurrency,
+        headless=replay_headless,
+        session_state=todoist_session_state(),
+        save_url_pattern=todoist_save_url_pattern,
+    ))
+    return {"results": results, "seconds": time.perf_counter() - start}
+
+
+def resolve_playbook_steps(objective: str):
+    playbook = get_playbook(objective)
+    return adjust_playbook(playbook, objective) if playbook else None
+
+
 def addPlaybookStep(driver, action, playbook_steps):
     if is_playbook_recording_enabled:
+        history_item = action.copy()
         selector = driver.get_selector(action)
         if selector:
-            history_item = action.copy()
             history_item['clicked_element'] = selector
-            playbook_steps.append(history_item)
-        else:
-            playbook_steps.append(action)
+        if not ("done" in action or "query_result" in action):
+            # what the page looked like, so a replay notices when it ends up somewhere else
+            history_item['checkpoint'] = replayCheckpoints.record_checkpoint(
+                driver.get_current_url(), driver.snapshot(), action)
+        playbook_steps.append(history_item)
 
 
 def savePlaybook(playbook_steps, objective):
-    playbookFileName = "playbook_" + str(int(time.time())) + ".json"
-    with open(playbookFileName, "w") as f:
-        json.dump(playbook_steps, f)
-    playbook_record = "playbook_record.json"
-    # get the playbook record if it exists
-    if os.path.exists(playbook_record):
-        with open(playbook_record, "r") as f:
-            playbook_records = json.load(f)
-    else:
-        playbook_records = []
-    embedding = get_embedding(objective)
-    playbook_records.append({
-        "objective": objective,
-        "playbookFile": playbookFileName,
-        "embedding": embedding,
-    })
-    with open(playbook_record, "w") as f:
-        json.dump(playbook_records, f)
+    objective_embedding = embedding.get_embedding(objective)
+    template = extract_template(objective, playbook_steps)
+    get_playbook_store().add(objective, playbook_steps, objective_embedding, template)
+
+
+def adjust_playbook(playbook, objective):
+    # fill in the recorded slots locally, the model is only asked when that does not work
+    if normalize_text(playbook['objective']) == normalize_text(objective):
+        return playbook['steps']
+    if playbook['template']:
+        steps = fill_template(playbook['template'], objective)
+        if steps is not None:
+            return steps
+    print("Could not adjust the playbook locally, asking the model...")
+    # the model only sees the actions, checkpoints go back onto the steps it left alone
+    actions = [{key: value for key, value in step.items() if key != 'checkpoint'}
+               for step in playbook['steps']]
+    adjusted = perception.adjust_playbook(actions, playbook['objective'], objective)
+    if not isinstance(adjusted, list) or len(adjusted) != len(actions) \
+            or not all(isinstance(step, dict) for step in adjusted):
+        print("The model did not keep the steps of the playbook, not replaying it")
+        return None
+    for step, action, recorded in zip(adjusted, actions, playbook['steps']):
+        if 'checkpoint' in recorded and step.get('clicked_element') == action.get('clicked_element'):
+            step['checkpoint'] = recorded['checkpoint']
+    return adjusted
 
 
 def get_playbook(objective):
     # get the playbooks
-    with open("playbook_record.json", "r") as f:
-        playbook_records = json.load(f)
-    # return playbook_records[0]
-    playbookIndex = recommendations_from_strings(
-        list(map(lambda x: x["embedding"], playbook_records)), objective)
-    if playbookIndex is not None:
-        return playbook_records[playbookIndex]
-    return None
+    return get_playbook_store().nearest(embedding.get_embedding(objective))
+
+
+playbook_store: PlaybookStore | None = None
+playbook_store_lock = threading.Lock()
+
+
+def get_playbook_store() -> PlaybookStore:
+    global playbook_store
+    with playbook_store_lock:
+        if playbook_store is None:
+            from playbookStore import PlaybookStore
+            playbook_store = PlaybookStore(playbook_store_file)
+            # move playbooks recorded before the store existed into it
+            if os.path.exists(legacy_playbook_record_file):
+                playbook_store.import_json(legacy_playbook_record_file)
+        return playbook_store
 
 
 def reset_playbook():
-    # if there is no playbook_record.json, then return
-    # if there is one, then reset it to an empty array
-    if os.path.exists("playbook_record.json"):
-        with open("playbook_record.json", "w") as f:
-            json.dump([], f)
+    get_playbook_store().reset()
 
 
-def get_driver(website: Union[Literal['todoist'], str]):
+def get_driver(website: Union[Literal['todoist'], str], headless: bool | None = None):
     print("Initializing the Vimbot driver...")
 
     init_functions = {
         'todoist': initTodoist,
     }
 
+    pool = current_pool()
     # Call the appropriate function
-    if website in init_functions:
-        driver = init_functions[website]()
+    if website == 'todoist' and pool:
+        driver = pool.acquire()
+    elif website in init_functions:
+        driver = init_functions[website](headless=headless)
     # if website contains http, then it is a custom website and we should start iwth that
     elif "http" in website:
-        driver = initCustomWebsite(website)
+        driver = initCustomWebsite(website, headless)
     else:
-        driver = initNoWebsite()
+        driver = initNoWebsite(headless)
     return driver
 
 
 def close_driver(driver: BrowserAgent):
     print("Closing the Vimbot driver...")
-    time.sleep(2)  # todoist needs a little time to save the changes
-    driver.close()
+    # todoist needs a little time to save the changes, it sends them once the UI settled
+    driver.wait_for_dom_quiet()
+    driver.wait_for_pending_requests(todoist_save_url_pattern)
+    pool = current_pool()
+    if pool and pool.owns(driver):
+        pool.release(driver)
+    else:
+        driver.close()
 
 # Opens todoist and performs login
 
 
 def initTodoistFresh():
-    driver = BrowserAgent()
+    driver = browserAgent.BrowserAgent()
+    loginTodoist(driver)
+    return driver
+
+
+def loginTodoist(driver: BrowserAgent):
+    if not os.getenv("TODOIST_USER") or not os.getenv("TODOIST_PASSWORD"):
+        raise Exception("Not logged in to Todoist, set TODOIST_USER and TODOIST_PASSWORD")
     driver.navigate("https://app.todoist.com/auth/login")
     driver.page.type('input[type="email"]', os.getenv(
         "TODOIST_USER"))  # type: ignore
@@ -151,50 +467,123 @@ def initTodoistFresh():
         "TODOIST_PASSWORD"))  # type: ignore
     driver.page.click('button[type="submit"]')
     driver.page.wait_for_selector('button[aria-controls="sidebar"]')
+
+
+def initTodoist(playwright=None, headless: bool | None = None):
+    # a throwaway profile starts much faster than a copy of a logged in one, the login
+    # comes from the saved session instead
+    driver = browserAgent.BrowserAgent(headless=headless, user_data_dir="", playwright=playwright)
+    state = session_store.load()
+    if state:
+        driver.restore_session(state)
+    ensureTodoistSession(driver)
+    driver.page.wait_for_selector('header')
     return driver
 
 
-def initTodoist():
-    driver = BrowserAgent()
-    driver.navigate("https://app.todoist.com")
+def isTodoistSessionValid(driver: BrowserAgent) -> bool:
+    from playwright.sync_api import Error as PlaywrightError
+
+    # todoist either shows the app or sends us to the login form
+    try:
+        driver.page.wait_for_selector(
+            'button[aria-controls="sidebar"], input[type="email"]', timeout=session_probe_timeout)
+    except PlaywrightError:
+        return False
+    return driver.page.query_selector('button[aria-controls="sidebar"]') is not None
+
+
+def ensureTodoistSession(driver: BrowserAgent):
+    driver.navigate(todoist_url)
+    if isTodoistSessionValid(driver):
+        return
+    with session_lock:
+        # another browser may have logged in while this one was probing
+        state = session_store.load() or sessionFromProfile(driver.playwright)
+        if state and state.get("saved_at") != (driver.session_state or {}).get("saved_at"):
+            driver.restore_session(state)
+            driver.navigate(todoist_url)
+            if isTodoistSessionValid(driver):
+                return
+        print("The saved Todoist session is not valid, logging in again...")
+        loginTodoist(driver)
+        driver.session_state = session_store.save(driver.export_session())
+        driver.navigate(todoist_url)
+
+
+def sessionFromProfile(playwright):
+    # browsers used to keep the login in their profile, take it from there once
+    if not os.path.exists(browserAgent.default_user_data_dir):
+        return None
+    driver = browserAgent.BrowserAgent(
+        headless=True, user_data_dir=browserAgent.default_user_data_dir, playwright=playwright)
+    try:
+        driver.navigate(todoist_url)
+        return session_store.save(driver.export_session()) if isTodoistSessionValid(driver) else None
+    finally:
+        driver.close()
+
+
+def todoist_session_state():
+    # the tabs of a batch can not log in themselves, so one browser checks the saved
+    # session first and logs in again (saving the new one) when it expired
+    initTodoist(headless=replay_headless).close()
+    return session_store.load()
+
+
+def resetTodoist(driver: BrowserAgent):
+    driver.reset(todoist_url)
     driver.page.wait_for_selector('header')
     driver.page.wait_for_selector('button[aria-controls="sidebar"]')
-    return driver
 
 
-def initNoWebsite():
-    driver = BrowserAgent()
-    return driver
+def create_todoist_pool(playwright):
+    def factory():
+        # the pool serves replays first, the reasoning fallback works headless too
+        return initTodoist(playwright, headless=replay_headless)
 
+    return AgentPool(
+        factory,
+        resetTodoist,
+        min_size=int(os.getenv("AGENT_POOL_MIN", "1")),
+        max_size=int(os.getenv("AGENT_POOL_MAX", "1")),
+    )
 
-def initCustomWebsite(websiteUrl: str):
-    driver = BrowserAgent()
-    driver.navigate(websiteUrl)
+
+def initNoWebsite(headless: bool | None = None):
+    driver = browserAgent.BrowserAgent(headless=headless)
     return driver
 
 
-app = Flask(__name__)
+def initCustomWebsite(websiteUrl: str, headless: bool | None = None):
+    driver = browserAgent.BrowserAgent(headless=headless)
+    driver.navigate(websiteUrl)
+    return driver
 
 
-@app.route("/ping", methods=["POST"])
-def ping():
-    # dummy function to test the Flask server
-    print("Received request to ping the Vimbot")
-    # return some dummy response as json
-    return {"status": "success"}
+@contextmanager
+def todoist_worker(index: int):
+    # every worker owns a playwright instance and a pool of browsers on its own thread
+    from playwright.sync_api import sync_playwright
 
+    print(f"Warming up the browser pool for worker {index}...")
+    playwright = sync_playwright().start()
+    pool = create_todoist_pool(playwright)
+    try:
+        pool.start()
+        set_current_pool(pool)
+        yield pool
+    finally:
+        set_current_pool(None)
+        pool.close()
+        playwright.stop()
 
-@app.route("/run", methods=["POST"])
-def run():
-    data = request.get_json()
-    prompt = data.get("prompt")
-    completion_condition = data.get("completion_condition")
-    # website = data.get("website")
 
+def run_job(job: Job):
     print(
-        f"Received request to run the Vimbot with prompt: {prompt} and completion_condition: {completion_condition}")
-    # result = do_image_reasoning_work("google", prompt, completion_condition)
-    result = replay_history("todoist", prompt, completion_condition)
+        f"Running job {job.id} with prompt: {job.prompt} and completion_condition: {job.completion_condition}")
+    with trace_task(job.id, prompt=job.prompt):
+        result = replay_history("todoist", job.prompt, job.completion_condition)
     # if result is a json, return it as is, otherwise return it as a string
     if isinstance(result, dict):
         return result
@@ -202,14 +591,176 @@ def run():
         return {"result": result}
 
 
+job_queue = JobQueue(
+    run_job,
+    num_workers=int(os.getenv("VIMBOT_WORKERS", "1")),
+    setup=todoist_worker,
+    name="worker",
+)
+
+
+def run_batch_job(job: Job):
+    objectives = job.params["objectives"]
+    print(f"Running batch job {job.id} with {len(objectives)} objectives")
+    with trace_task(job.id, prompt=job.prompt):
+        return replay_batch(objectives, job.params["concurrency"])
+
+
+# batches launch their own browser, so they get their own workers: BATCH_WORKERS
+# batches run at the same time and the rest wait
+batch_queue = JobQueue(
+    run_batch_job,
+    num_workers=int(os.getenv("BATCH_WORKERS", "1")),
+    name="batch-worker",
+)
+job_queues = {"run": job_queue, "batch": batch_queue}
+
+
+def find_job_queue(job_id: str) -> JobQueue | None:
+    return next((jobs for jobs in job_queues.values() if jobs.get(job_id)), None)
+
+
+def report_job_queues():
+    # gauges are read at scrape time, a pool whose workers all died shows up as 0 alive
+    for name, jobs in job_queues.items():
+        stats = jobs.stats()
+        telemetry.set_gauge("vimbot_workers_alive", "Workers that are running, by job queue",
+                            stats["alive"], queue=name)
+        telemetry.set_gauge("vimbot_workers_dead", "Workers whose setup failed, by job queue",
+                            len(stats["dead"]), queue=name)
+        telemetry.set_gauge("vimbot_jobs_queued", "Jobs waiting for a worker, by job queue",
+                            stats["queued"], queue=name)
+
+
+def create_app():
+    # flask (and werkzeug) are only imported when the server starts
+    from flask import Flask, Response, request
+
+    app = Flask(__name__)
+
+    @app.route("/ping", methods=["POST"])
+    def ping():
+        # dummy function to test the Flask server
+        print("Received request to ping the Vimbot")
+        # return some dummy response as json
+        return {"status": "success"}
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        report_job_queues()
+        return telemetry.registry.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+    @app.route("/run", methods=["POST"])
+    def run():
+        data = request.get_json()
+        prompt = data.get("prompt")
+        completion_condition = data.get("completion_condition")
+        # website = data.get("website")
+
+        print(
+            f"Received request to run the Vimbot with prompt: {prompt} and completion_condition: {completion_condition}")
+        job = job_queue.submit(prompt, completion_condition)
+        return job.to_dict(), 202
+
+    @app.route("/run/stream", methods=["POST"])
+    def run_stream():
+        data = request.get_json()
+        prompt = data.get("prompt")
+        completion_condition = data.get("completion_condition")
+        print(f"Received request to stream the Vimbot with prompt: {prompt}")
+        job = job_queue.submit(prompt, completion_condition, stream=True)
+        return Response(stream_job(job), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            # proxies must not hold the events back
+            "X-Accel-Buffering": "no",
+        })
+
+    @app.route("/jobs", methods=["GET"])
+    def job_queue_status():
+        return {name: jobs.stats() for name, jobs in job_queues.items()}
+
+    @app.route("/jobs/<job_id>", methods=["GET"])
+    def job_status(job_id):
+        jobs = find_job_queue(job_id)
+        job = jobs.get(job_id) if jobs else None
+        if not job:
+            return {"error": f"Unknown job {job_id}"}, 404
+        return job.to_dict()
+
+    @app.route("/jobs/<job_id>/result", methods=["GET"])
+    def job_result(job_id):
+        jobs = find_job_queue(job_id)
+        job = jobs.get(job_id) if jobs else None
+        if not job:
+            return {"error": f"Unknown job {job_id}"}, 404
+        if not job.finished:
+            return job.to_dict(), 409
+        if job.status != "succeeded":
+            return job.to_dict(), 410 if job.status == "cancelled" else 500
+        return job.result
+
+    @app.route("/jobs/<job_id>/cancel", methods=["POST"])
+    def cancel_job(job_id):
+        jobs = find_job_queue(job_id)
+        job = jobs.cancel(job_id) if jobs else None
+        if not job:
+            return {"error": f"Unknown job {job_id}"}, 404
+        return job.to_dict()
+
+    @app.route("/run_batch", methods=["POST"])
+    def run_batch():
+        data = request.get_json(silent=True) or {}
+        prompts = data.get("prompts")
+        if not isinstance(prompts, list) or not prompts or not all(isinstance(prompt, str) for prompt in prompts):
+            return {"error": "prompts must be a non-empty list of strings"}, 400
+        try:
+            concurrency = int(data.get("concurrency", batch_concurrency))
+        except (TypeError, ValueError):
+            concurrency = 0
+        if not 1 <= concurrency <= batch_max_concurrency:
+            return {"error": f"concurrency must be a number from 1 to {batch_max_concurrency}"}, 400
+        print(f"Received request to replay {len(prompts)} prompts")
+        job = batch_queue.submit(f"Replay {len(prompts)} objectives", "",
+                                 params={"objectives": prompts, "concurrency": concurrency})
+        return job.to_dict(), 202
+
+    return app
+
+
+def format_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def stream_job(job: Job):
+    # the first event goes out right away, so clients see the job before it even starts
+    yield format_event("queued", job.to_dict())
+    finished = False
+    try:
+        while not finished:
+            try:
+                message = job.events.get(timeout=stream_heartbeat)  # type: ignore
+            except queue.Empty:
+                # keeps proxies from closing the connection, and a write to a client that
+                # went away is how we notice it left
+                yield ": heartbeat\n\n"
+                continue
+            finished = message["event"] == "result"
+            yield format_event(message["event"], message["data"])
+    finally:
+        if not finished:
+            print(f"The client of job {job.id} went away, cancelling it")
+            job_queue.cancel(job.id)
+
+
 def classic_mode():
     # The classic mode of the Vimbot
     print("Starting the Vimbot in classic mode...")
     objective = input("Please enter your objective: ")
     completion_condition = input(
         "Please enter your the completion condition: ")
-    result = do_image_reasoning_work(
-        "todoist", objective, completion_condition)
+    with trace_task(uuid.uuid4().hex, prompt=objective):
+        result = do_image_reasoning_work(
+            "todoist", objective, completion_condition)
     if isinstance(result, dict):
         return result
     else:
@@ -220,7 +771,19 @@ def replay_mode():
     # The replay mode of the Vimbot
     print("Starting the Vimbot in replay mode...")
     objective = input("Please enter your objective: ")
-    replay_history("todoist", objective, "When the objective seems complete")
+    with trace_task(uuid.uuid4().hex, prompt=objective):
+        replay_history("todoist", objective, "When the objective seems complete")
+
+
+def batch_mode(objectives_file: str, concurrency: int):
+    # The batch mode of the Vimbot, one objective per line
+    with open(objectives_file, "r") as f:
+        objectives = [line.strip() for line in f if line.strip()]
+    print(f"Replaying {len(objectives)} objectives, {concurrency} at a time...")
+    batch = replay_batch(objectives, concurrency)
+    for result in batch["results"]:
+        print(json.dumps(result))
+    print(f"Replayed {len(objectives)} objectives in {batch['seconds']:.1f}s")
 
 
 if __name__ == "__main__":
@@ -229,13 +792,28 @@ if __name__ == "__main__":
     parser.add_argument("--classic", action="store_true")
     parser.add_argument("--replay", action="store_true")
     parser.add_argument("--reset", action="store_true")
+    parser.add_argument("--batch", metavar="OBJECTIVES_FILE")
+    parser.add_argument("--concurrency", type=int, default=batch_concurrency)
     args = parser.parse_args()
-    if args.classic:
-        classic_mode()
-    elif args.replay:
-        replay_mode()
-    elif args.reset:
-        reset_playbook()
-    else:
-        print("Starting the Flask server...")
-        app.run(host="0.0.0.0", port=8000)
+    try:
+        if args.classic:
+            classic_mode()
+        elif args.replay:
+            replay_mode()
+        elif args.reset:
+            reset_playbook()
+        elif args.batch:
+            batch_mode(args.batch, args.concurrency)
+        else:
+            app = create_app()
+            job_queue.start()
+            batch_queue.start()
+            print("Starting the Flask server...")
+            try:
+                app.run(host="0.0.0.0", port=8000)
+            finally:
+                job_queue.stop()
+                batch_queue.stop()
+    finally:
+        # playbooks are saved in the background, the process must not exit before that
+        background.drain()
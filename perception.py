@@ -1,39 +1,122 @@
-import base64
 import json
 import os
-from io import BytesIO
+import time
+import uuid
+from dataclasses import dataclass
 
-import openai
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionToolParam, ChatCompletionMessageToolCall, ChatCompletionMessageToolCallParam
+from openai.types.chat.chat_completion_message_tool_call import Function
 from openai import _types
 
 from dotenv import load_dotenv
 from PIL.Image import Image
-from typing import List
+from typing import List, Literal
+
+from screenshot import Screenshot
+from llmClient import llm
+import telemetry
+from telemetry import span
 
 from glom import glom
 from termcolor import colored
 
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
 IMG_RES = 760
+vision_model = "gpt-4-vision-preview"
+text_model = os.getenv("TEXT_MODEL", "gpt-3.5-turbo")
+# "vision" sends a screenshot every step, "text-first" lets the text model decide from the
+# hint descriptions and only sends a screenshot when it can not
+perception_mode = os.getenv("PERCEPTION_MODE", "vision")
+
+
+class StepLimitExceeded(Exception):
+    pass
+
+
+@dataclass
+class ContextPolicy:
+    # how many of the most recent steps are sent as full tool calls, older ones are summarized
+    window: int = 3
+    # the reasoning loop gives up after this many steps
+    max_steps: int | None = 30
+
+
+@dataclass
+class StepUsage:
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    latency: float
+
+
+default_context_policy = ContextPolicy(
+    window=int(os.getenv("CONTEXT_WINDOW", "3")),
+    max_steps=int(os.getenv("MAX_STEPS", "30")) or None,
+)
 
+ImageDetail = Literal["low", "high", "auto"]
+# the images for each attempt of a vision call, sharpest last
+ImageAttempts = List[tuple[Screenshot, ImageDetail]]
 
-def resize_image(image: Image):
+
+@dataclass
+class ResolutionPolicy:
+    # when on, a vision call first sends a small low detail image and only sends the
+    # full one when the model could not work with it
+    adaptive: bool = True
+    low_width: int = 512
+    high_width: int = IMG_RES
+
+
+default_resolution_policy = ResolutionPolicy(
+    adaptive=os.getenv("ADAPTIVE_RESOLUTION", "1") == "1",
+    low_width=int(os.getenv("LOW_RES_WIDTH", "512")),
+)
+
+
+def resize_image(image: Image, width: int = IMG_RES):
     W, H = image.size
-    image = image.resize((IMG_RES, int(IMG_RES * H / W)))
+    image = image.resize((width, int(width * H / W)))
     return image
 
 # Function to encode the image
 
 
-def encode_and_resize(image: Image):
-    W, H = image.size
-    image = image.resize((IMG_RES, int(IMG_RES * H / W)))
-    buffer = BytesIO()
-    image.save(buffer, format="PNG")
-    encoded_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
-    return encoded_image
+def encode_and_resize(image: Screenshot | Image, width: int = IMG_RES) -> Screenshot:
+    # screenshots captured at (or below) the target size are already encoded, send them as is
+    if isinstance(image, Screenshot):
+        if image.width <= width:
+            return image
+        image = image.image()
+    with span("perception.encode_and_resize"):
+        return Screenshot.from_image(resize_image(image, width) if image.width > width else image)
+
+
+def image_attempts(screenshot: Screenshot | Image,
+                   resolution: ResolutionPolicy = default_resolution_policy) -> ImageAttempts:
+    high = encode_and_resize(screenshot, resolution.high_width)
+    if not resolution.adaptive:
+        return [(high, "auto")]
+    return [(encode_and_resize(high, resolution.low_width), "low"), (high, "high")]
+
+
+def build_image_message(prompt: str, image: Screenshot, detail: ImageDetail) -> ChatCompletionMessageParam:
+    return {
+        "role": "user",
+        "content": [
+            {
+                "type": "text",
+                "text": prompt,
+            },
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": image.data_url(),
+                    "detail": detail,
+                },
+            }
+        ],
+    }
 
 
 def build_action_hint_str(possible_actions_hints: dict[str, str] | None) -> str:
@@ -198,18 +281,21 @@ def build_initial_prompt(
         objective: str,
         completion_condition: str,
         current_url: str,
-        possible_actions_hints: dict[str, str]):
-    return f'''
+        possible_actions_hints: dict[str, str],
+        note: str | None = None):
+    prompt = f'''
 Given the image of a website, your objective is: {objective} and the completion condition is: {completion_condition}. You are currently on the website: {current_url}.
 DO NOT respond to the user under ANY circumstances. Only respond with a tools call.
 {build_action_hint_str(possible_actions_hints)}
     '''
+    return f"{note}\n{prompt}" if note else prompt
 
 
-def build_subsequent_prompt(current_url, possible_actions_hints: dict[str, str]):
-    return f'''What should the next action or result be? You are currently on the website: {current_url}.
+def build_subsequent_prompt(current_url, possible_actions_hints: dict[str, str], note: str | None = None):
+    prompt = f'''What should the next action or result be? You are currently on the website: {current_url}.
 {build_action_hint_str(possible_actions_hints)}
 '''
+    return f"{note}\n{prompt}" if note else prompt
 
 
 def map_tool_call_to_param(tool_call: ChatCompletionMessageToolCall) -> ChatCompletionMessageToolCallParam:
@@ -223,98 +309,310 @@ def map_tool_call_to_param(tool_call: ChatCompletionMessageToolCall) -> ChatComp
     }
 
 
-def get_actions(screenshot: Image,
+def get_actions(screenshot: Screenshot | Image | ImageAttempts,
                 objective: str,
                 completion_condition: str,
                 current_url: str,
                 possible_actions_hints: dict[str, str],
-                prompt_history: List[str | List[ChatCompletionMessageToolCall]]):
-    encoded_screenshot = encode_and_resize(screenshot)
+                prompt_history: List[str | List[ChatCompletionMessageToolCall]],
+                note: str | None = None,
+                policy: ContextPolicy = default_context_policy,
+                usage_log: List[StepUsage] | None = None,
+                resolution: ResolutionPolicy = default_resolution_policy):
+    attempts = screenshot if isinstance(screenshot, list) else image_attempts(screenshot, resolution)
     # if prompt_history is empty
     if not prompt_history:
         next_prompt = build_initial_prompt(
-            objective, completion_condition, current_url, possible_actions_hints)
+            objective, completion_condition, current_url, possible_actions_hints, note)
     else:
         next_prompt = build_subsequent_prompt(
-            current_url, possible_actions_hints)
+            current_url, possible_actions_hints, note)
+
+    if policy.max_steps is not None and len(prompt_history) > policy.max_steps:
+        raise StepLimitExceeded(
+            f"Giving up after {policy.max_steps} steps without completing the objective")
+
+    for attempt, (image, detail) in enumerate(attempts):
+        last_attempt = attempt == len(attempts) - 1
+        tools = build_function_calls()
+        if not last_attempt:
+            tools.append(build_need_more_detail_tool())
+        messages = build_messages(
+            prompt_history, build_image_message(next_prompt, image, detail), policy)
+
+        # pretty_print_conversation(messages)
+        tool_calls, json_response = query_open_ai_for_json(
+            messages, vision_model, tools, usage_log=usage_log)
+        if last_attempt:
+            break
+        if tool_calls[0].function.name == "need_more_detail":
+            problem = f"the model asked for more detail ({json_response.get('reason')})"
+        else:
+            problem = validate_action(json_response, possible_actions_hints)
+        if not problem:
+            break
+        print(f"Sending a sharper screenshot, {problem}")
+        telemetry.inc("vimbot_resolution_escalations_total",
+                      "Vision calls repeated with a sharper image", call="actions")
 
-    tools = build_function_calls()
+    if not prompt_history:
+        prompt_history.append(next_prompt)
 
-    next_message: ChatCompletionMessageParam = {
-        "role": "user",
-        "content": [
-            {
-                "type": "text",
-                "text": next_prompt,
-            },
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{encoded_screenshot}",
-                },
-            }
-        ],
-    }
+    prompt_history.append(tool_calls)
+    return json_response
 
-    messages: List[ChatCompletionMessageParam] = []
+
+def get_actions_from_text(objective: str,
+                          completion_condition: str,
+                          current_url: str,
+                          possible_actions_hints: dict[str, str],
+                          prompt_history: List[str | List[ChatCompletionMessageToolCall]],
+                          note: str | None = None,
+                          policy: ContextPolicy = default_context_policy,
+                          usage_log: List[StepUsage] | None = None) -> dict | None:
+    """Ask the text model for the next action using only the hint descriptions.
+
+    Returns None when the model asks to see the page or picks an action that can not be
+    performed on it, in which case the caller falls back to get_actions with a screenshot.
+    """
+    if policy.max_steps is not None and len(prompt_history) > policy.max_steps:
+        raise StepLimitExceeded(
+            f"Giving up after {policy.max_steps} steps without completing the objective")
+
+    next_prompt = build_text_prompt(current_url, possible_actions_hints, note)
     if not prompt_history:
-        messages.append(next_message)
-    else:
-        messages = []
-        for prompt in prompt_history:
-            message: ChatCompletionMessageParam
-            if isinstance(prompt, str):
-                messages.append({
-                    "role": "assistant",
-                    "content": prompt,
-                })
-            else:
-                if len(prompt) == 0:
-                    continue
-                messages.append({
-                    "role": "assistant",
-                    "content": None,
-                    "tool_calls": map(map_tool_call_to_param, prompt)
-                })
-                for tool_call in prompt:
-                    messages.append({
-                        "role": "tool",
-                        "content": "Success",
-                        "tool_call_id": tool_call.id
-                    })
-
-        messages.append(next_message)
-
-    # pretty_print_conversation(messages)
+        next_prompt = f'''Given the descriptions of the elements on a website, your objective is: {objective} and the completion condition is: {completion_condition}.
+{next_prompt}'''
+    messages: List[ChatCompletionMessageParam] = [
+        {"role": "system", "content": text_mode_instructions},
+        *build_messages(prompt_history, {"role": "user", "content": next_prompt}, policy),
+    ]
+    # results have to be read off the page, so they are left to the vision model
+    tools = [tool for tool in build_function_calls() if tool["function"]["name"] != "query_result"]
+    tools.append(build_need_screenshot_tool())
+
     tool_calls, json_response = query_open_ai_for_json(
-        messages, "gpt-4-vision-preview", tools)
+        messages, text_model, tools, usage_log=usage_log)
 
+    if tool_calls[0].function.name == "need_screenshot":
+        problem = f"the text model needs to see the page ({json_response.get('reason')})"
+    else:
+        problem = validate_action(json_response, possible_actions_hints)
+    telemetry.inc("vimbot_text_perception_total", "Steps the text model was asked to decide",
+                  outcome="escalated" if problem else "accepted")
+    if problem:
+        print(f"Falling back to the screenshot, {problem}")
+        return None
+
+    # the prompt that was sent, the first one states the objective for the descriptions
     if not prompt_history:
         prompt_history.append(next_prompt)
-
     prompt_history.append(tool_calls)
     return json_response
 
 
-def adjust_playbook(playbook, original_objective, incoming_objective):
+text_mode_instructions = '''You can not see the website. Every element you can interact with is listed with its hint and a description.
+DO NOT respond to the user under ANY circumstances. Only respond with a tools call.
+If the descriptions are not enough to be sure about the next action, call need_screenshot instead of guessing.'''
+
+
+def build_text_prompt(current_url, possible_actions_hints: dict[str, str], note: str | None = None):
+    hint_str = build_action_hint_str(possible_actions_hints) or "\nNothing on the page can be clicked.\n"
+    prompt = f'''What should the next action be? You are currently on the website: {current_url}.
+{hint_str}'''
+    return f"{note}\n{prompt}" if note else prompt
+
+
+def build_need_screenshot_tool() -> ChatCompletionToolParam:
+    return {
+        "type": "function",
+        "function": {
+            "name": "need_screenshot",
+            "description": "Ask for a screenshot of the website when the element descriptions are not enough to decide",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "reason": {
+                        "type": "string",
+                        "description": "What is missing from the descriptions",
+                    },
+                },
+            },
+        },
+    }
+
+
+def build_need_more_detail_tool() -> ChatCompletionToolParam:
+    return {
+        "type": "function",
+        "function": {
+            "name": "need_more_detail",
+            "description": "Ask for a sharper image when the text or hints in this one are too small to read",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "reason": {
+                        "type": "string",
+                        "description": "What could not be read",
+                    },
+                },
+            },
+        },
+    }
+
+
+def validate_action(action: dict, possible_actions_hints: dict[str, str] | None) -> str | None:
+    """Return why the action can not be performed on the current page, or None if it can."""
+    if "done" in action:
+        return None
+    if "click" in action:
+        if action["click"] not in (possible_actions_hints or {}):
+            return f"there is no hint {action['click']} on the page"
+        if "type" in action and not isinstance(action["type"], str):
+            return "there is nothing to type"
+        return None
+    if "scroll" in action:
+        return None if action["scroll"] in ("up", "down") else f"can not scroll {action['scroll']}"
+    if "navigate" in action:
+        return None if action["navigate"] else "there is no URL to navigate to"
+    if "query_result" in action:
+        # like query_screenshot, a result is trusted, nothing found may just be a blurry image
+        return None if action["query_result"] else "nothing was found on the page"
+    return f"{action} is not an action"
+
+
+def append_to_history(prompt_history: List[str | List[ChatCompletionMessageToolCall]],
+                      tool_calls: List[ChatCompletionMessageToolCall],
+                      objective: str,
+                      completion_condition: str,
+                      current_url: str,
+                      possible_actions_hints: dict[str, str]):
+    # for steps decided without asking the model, so later prompts still include them
+    if not prompt_history:
+        prompt_history.append(build_initial_prompt(
+            objective, completion_condition, current_url, possible_actions_hints))
+    prompt_history.append(tool_calls)
+
+
+def tool_calls_for_action(action: dict) -> List[ChatCompletionMessageToolCall]:
+    # a step replayed from a playbook, written down as if the model had chosen it
+    if "done" in action:
+        name = "done"
+    elif "query_result" in action:
+        name = "query_result"
+    elif "click" in action:
+        name = "type_and_click" if "type" in action else "click"
+    elif "navigate" in action:
+        name = "navigate"
+    elif "scroll" in action:
+        name = "scroll"
+    else:
+        return []
+    arguments = {key: value for key, value in action.items() if key not in ("clicked_element", "checkpoint")}
+    return [ChatCompletionMessageToolCall(
+        id=f"call_{uuid.uuid4().hex}",
+        type="function",
+        function=Function(name=name, arguments=json.dumps(arguments)),
+    )]
+
+
+def build_messages(prompt_history: List[str | List[ChatCompletionMessageToolCall]],
+                   next_message: ChatCompletionMessageParam,
+                   policy: ContextPolicy) -> List[ChatCompletionMessageParam]:
+    # the objective, a summary of old steps and the last few steps in full, so the
+    # prompt stops growing once a task is longer than the window
+    if not prompt_history:
+        return [next_message]
+    initial_prompt, steps = prompt_history[0], prompt_history[1:]
+    recent_steps = steps[max(0, len(steps) - policy.window):] if policy.window else []
+    older_steps = steps[:len(steps) - len(recent_steps)]
+
+    messages: List[ChatCompletionMessageParam] = [{
+        "role": "user",
+        "content": initial_prompt,  # type: ignore
+    }]
+    if older_steps:
+        messages.append({
+            "role": "user",
+            "content": summarize_steps(older_steps),  # type: ignore
+        })
+    for tool_calls in recent_steps:
+        if not tool_calls:
+            continue
+        messages.append({
+            "role": "assistant",
+            "content": None,
+            # a list, not a map: a retry sends the same messages again
+            "tool_calls": [map_tool_call_to_param(tool_call) for tool_call in tool_calls]  # type: ignore
+        })
+        for tool_call in tool_calls:  # type: ignore
+            messages.append({
+                "role": "tool",
+                "content": "Success",
+                "tool_call_id": tool_call.id
+            })
+    messages.append(next_message)
+    return messages
+
+
+def summarize_steps(steps) -> str:
+    lines = []
+    for step_number, tool_calls in enumerate(steps, start=1):
+        for tool_call in tool_calls or []:
+            lines.append(
+                f"{step_number}. {tool_call.function.name} {tool_call.function.arguments}")
+    return "These actions were already performed, oldest first:\n" + "\n".join(lines)
+
+
+def summarize_usage(usage_log: List[StepUsage]):
+    return {
+        "steps": len(usage_log),
+        "prompt_tokens": sum(usage.prompt_tokens for usage in usage_log),
+        "completion_tokens": sum(usage.completion_tokens for usage in usage_log),
+        "latency": sum(usage.latency for usage in usage_log),
+    }
+
+
+def adjust_playbook(playbook, original_objective, incoming_objective) -> list | None:
     prompt = f'''
     This playbook was generated for the following objective {original_objective}.
-    The playbook is: {playbook}.
+    The playbook is: {json.dumps(playbook)}.
     Adjust the playbook for the new objective: {incoming_objective}.
     You are not allowed to add or remove any new actions to the playbook.
     You may not change any of the keys in the playbook, only the values.
-    Return it as a valid JSON array.
+    Call adjusted_playbook with the steps.
     '''
+    # the whole playbook comes back, which does not fit into the tokens of an action
     _, json_response = query_open_ai_for_json([{
         "role": "user",
         "content": prompt,
-    }], "gpt-3.5-turbo")
+    }], text_model, [build_adjusted_playbook_tool()], max_tokens=1000)
 
-    return json_response
+    return json_response.get("steps")
+
+
+def build_adjusted_playbook_tool() -> ChatCompletionToolParam:
+    return {
+        "type": "function",
+        "function": {
+            "name": "adjusted_playbook",
+            "description": "Return the playbook adjusted for the new objective",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "steps": {
+                        "type": "array",
+                        "items": {"type": "object"},
+                        "description": "The steps of the playbook in the same order, with the same keys",
+                    },
+                },
+                "required": ["steps"],
+            },
+        },
+    }
 
 
-def query_screenshot(screenshot: Image, objective):
-    encoded_screenshot = encode_and_resize(screenshot)
+def query_screenshot(screenshot: Screenshot | Image, objective, resolution: ResolutionPolicy = default_resolution_policy):
     example_result = json.dumps(
         {"query_result": [{"title": "some title"}, {"description": "some description"}]})
     prompt = f'''
@@ -324,38 +622,53 @@ def query_screenshot(screenshot: Image, objective):
     The result I want from you is a valid JSON object.
     Do not return the JSON inside a code block. Only return 1 object with an array of "query_result" objects.
     '''
-    _, json_response = query_open_ai_for_json([{
-        "role": "user",
-        "content": [
-            {
-                "type": "text",
-                "text": prompt,
-            },
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{encoded_screenshot}",
-                },
-            }
-        ],
-    }], "gpt-4-vision-preview")
+    attempts = image_attempts(screenshot, resolution)
+    for attempt, (image, detail) in enumerate(attempts):
+        last_attempt = attempt == len(attempts) - 1
+        tools = [tool for tool in build_function_calls() if tool["function"]["name"] == "query_result"]
+        if not last_attempt:
+            tools.append(build_need_more_detail_tool())
+        tool_calls, json_response = query_open_ai_for_json(
+            [build_image_message(prompt, image, detail)], vision_model, tools)
+        # nothing found in a blurry image may just mean it could not be read
+        if last_attempt or (tool_calls[0].function.name == "query_result" and json_response.get("query_result")):
+            break
+        print("Sending a sharper screenshot for the query...")
+        telemetry.inc("vimbot_resolution_escalations_total",
+                      "Vision calls repeated with a sharper image", call="query")
 
     if ("query_result" in json_response and not json_response["query_result"]) \
             or ("message" in json_response):
         print("No query result found in response. Saving screenshot.")
         # save screenshot for debugging
-        screenshot.save("screenshot.png")
+        image.save("screenshot")
 
     return json_response
 
 
-def query_open_ai_for_json(messages: List[ChatCompletionMessageParam], model, tools: List[ChatCompletionToolParam] | _types.NotGiven = _types.NotGiven(), max_tokens=130) -> tuple[List[ChatCompletionMessageToolCall], dict]:
-    response = openai.chat.completions.create(
-        model=model,
-        messages=messages,
-        tools=tools,
-        max_tokens=max_tokens,
-    )
+def query_open_ai_for_json(messages: List[ChatCompletionMessageParam], model, tools: List[ChatCompletionToolParam] | _types.NotGiven = _types.NotGiven(), max_tokens=130, usage_log: List[StepUsage] | None = None) -> tuple[List[ChatCompletionMessageToolCall], dict]:
+    start = time.perf_counter()
+    with span("llm.chat", model=model) as attributes:
+        response = llm.chat(
+            model=model,
+            messages=messages,
+            tools=tools,
+            max_tokens=max_tokens,
+        )
+        if response.usage:
+            attributes["prompt_tokens"] = response.usage.prompt_tokens
+            attributes["completion_tokens"] = response.usage.completion_tokens
+            telemetry.inc("vimbot_llm_tokens_total", "Tokens sent to and received from the model",
+                          response.usage.prompt_tokens, model=model, kind="prompt")
+            telemetry.inc("vimbot_llm_tokens_total", "Tokens sent to and received from the model",
+                          response.usage.completion_tokens, model=model, kind="completion")
+    if usage_log is not None and response.usage:
+        usage_log.append(StepUsage(
+            model,
+            response.usage.prompt_tokens,
+            response.usage.completion_tokens,
+            time.perf_counter() - start,
+        ))
 
     print(f"Response: {response}")
 
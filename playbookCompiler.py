@@ -0,0 +1,165 @@
+from dataclasses import dataclass
+from typing import Callable, List, Literal
+
+from playwright.sync_api import Error as PlaywrightError
+
+from jobs import raise_if_cancelled
+from replayCheckpoints import verify_step
+from telemetry import span
+
+# how many elements each recorded selector matches, null for selectors that are not
+# plain CSS (e.g. the ones playwright records with PWDEBUG=1)
+describe_selectors_script = '''(selectors) => selectors.map((selector) => {
+    let elements;
+    try {
+        elements = document.querySelectorAll(selector);
+    } catch (e) {
+        return null;
+    }
+    return { count: elements.length };
+})'''
+
+describe_element_script = '''(element) => {
+    const textTypes = ['', 'text', 'search', 'email', 'url', 'tel', 'password', 'number'];
+    const tagName = element.tagName.toLowerCase();
+    const field = (tagName === 'input' && textTypes.includes((element.getAttribute('type') || '').toLowerCase()))
+        || tagName === 'textarea';
+    if (element.isContentEditable) {
+        return { fillable: true, empty: element.textContent === '' };
+    }
+    return { fillable: field && !element.disabled && !element.readOnly, empty: field && element.value === '' };
+}'''
+
+
+@dataclass
+class PlanStep:
+    kind: Literal["click", "fill", "type", "scroll", "navigate"]
+    selector: str | None = None
+    # the text to fill or type, the url or the scroll direction
+    value: str | None = None
+    # a scroll is skipped when this selector is already on the page, the locator
+    # of the step after it scrolls the element into view anyway
+    unless_present: str | None = None
+    # how many playbook steps this step replays, starting at `index`
+    covers: int = 1
+    index: int = 0
+    checkpoint: dict | None = None
+
+
+@dataclass
+class ReplayPlan:
+    steps: List[PlanStep]
+    # the index of the first query_result or done, replayed step by step from there
+    end: int
+
+    @property
+    def covers(self) -> int:
+        return sum(step.covers for step in self.steps)
+
+    @property
+    def selectors(self) -> List[str]:
+        return list(dict.fromkeys(step.selector for step in self.steps if step.selector))
+
+
+def compile_playbook(steps: List[dict]) -> ReplayPlan | None:
+    """Compile the steps before the first query_result or done into fewer browser round trips.
+
+    A click followed by typing becomes one fill step and scrolls in front of a recorded
+    selector are dropped once it is on the page. Returns None when a click has no recorded
+    selector, those need the hints on screen.
+    """
+    end = next((index for index, step in enumerate(steps)
+               if "query_result" in step or "done" in step), len(steps))
+    actions = steps[:end]
+    if any("click" in action and "clicked_element" not in action for action in actions):
+        return None
+    plan: List[PlanStep] = []
+    for index, action in enumerate(actions):
+        previous = plan[-1] if plan else None
+        checkpoint = action.get("checkpoint")
+        if "click" in action and "type" in action:
+            plan.append(PlanStep("fill", action["clicked_element"], action["type"],
+                                 index=index, checkpoint=checkpoint))
+        elif "type" in action and previous and previous.kind == "click":
+            # typing right after a click goes to the clicked element
+            plan[-1] = PlanStep("fill", previous.selector, action["type"], covers=previous.covers + 1,
+                                index=previous.index, checkpoint=previous.checkpoint)
+        elif "click" in action:
+            plan.append(PlanStep("click", action["clicked_element"], index=index, checkpoint=checkpoint))
+        elif "type" in action:
+            plan.append(PlanStep("type", value=action["type"], index=index, checkpoint=checkpoint))
+        elif "navigate" in action:
+            plan.append(PlanStep("navigate", value=action["navigate"], index=index))
+        elif "scroll" in action:
+            plan.append(PlanStep("scroll", value=action["scroll"], index=index, checkpoint=checkpoint))
+    # a scroll only matters when the page is not left to a locator right after it
+    next_selector = None
+    for step in reversed(plan):
+        if step.kind == "scroll":
+            step.unless_present = next_selector
+        elif step.kind in ("click", "fill"):
+            next_selector = step.selector
+        else:
+            next_selector = None
+    return ReplayPlan(plan, end)
+
+
+def run_plan(driver, plan: ReplayPlan, on_step: Callable[[PlanStep], None] | None = None) -> int:
+    """Replay the compiled steps with `driver`, a BrowserAgent, and return how many playbook
+    steps were replayed. `on_step` is called after every step that was replayed.
+
+    Every selector is checked in one evaluate call first, when one of them matches more than
+    one element nothing is replayed. A click or fill whose checkpoint does not fit the page
+    stops the plan at its step, the step by step replay takes over from there.
+    """
+    with span("replay.validate", selectors=len(plan.selectors)):
+        found = dict(zip(plan.selectors, driver.page.evaluate(describe_selectors_script, plan.selectors)))
+    ambiguous = [selector for selector, info in found.items() if info and info["count"] > 1]
+    if ambiguous:
+        print(f"Recorded selectors match more than one element: {ambiguous}")
+        return 0
+    for step in plan.steps:
+        raise_if_cancelled()
+        with span("replay.step", kind=step.kind):
+            if step.kind == "scroll":
+                if not is_present(driver, step.unless_present):
+                    driver.scroll(step.value)
+            elif step.kind == "navigate":
+                driver.navigate(step.value)
+            elif step.kind == "type":
+                driver.type(step.value)
+            elif not verify_step(driver, step.checkpoint, step.selector):
+                print(f"Playbook step {step.index + 1} does not fit the page, replaying it step by step")
+                driver.hint_snapshot = None
+                return step.index
+            elif step.kind == "click":
+                driver.page.locator(step.selector).click()
+            elif step.kind == "fill":
+                fill(driver, step.selector, step.value)
+        if on_step:
+            on_step(step)
+    # whatever we did, the hints on screen are stale now
+    driver.hint_snapshot = None
+    return plan.end
+
+
+def is_present(driver, selector: str | None) -> bool:
+    # checked when the scroll comes up, the steps before it may have changed the page
+    if not selector:
+        return False
+    try:
+        return driver.page.locator(selector).count() == 1
+    except PlaywrightError:
+        return False
+
+
+def fill(driver, selector: str, text: str):
+    # one round trip instead of one per character, as long as it ends up the same as
+    # clicking the element and typing: an empty text field
+    locator = driver.page.locator(selector)
+    element = locator.evaluate(describe_element_script)
+    if element["fillable"] and element["empty"]:
+        locator.fill(text)
+    else:
+        locator.click()
+        driver.type(text)
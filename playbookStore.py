@@ -0,0 +1,170 @@
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Sequence
+
+import numpy as np
+
+from embeddingIndex import EmbeddingIndex
+
+# every entry upgrades the schema from the version before it (PRAGMA user_version)
+migrations = [
+    '''
+    CREATE TABLE playbooks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        objective TEXT NOT NULL,
+        steps TEXT NOT NULL,
+        embedding BLOB NOT NULL,
+        created_at REAL NOT NULL
+    )
+    ''',
+    # steps with slots for the values that came from the objective, see playbookTemplate
+    "ALTER TABLE playbooks ADD COLUMN template TEXT",
+    # bumped by every reset, ids are never reused so they can not tell
+    "CREATE TABLE store_state (generation INTEGER NOT NULL)",
+    "INSERT INTO store_state (generation) VALUES (0)",
+]
+
+
+class PlaybookStore:
+    """SQLite backed library of recorded playbooks.
+
+    Each playbook is a single row holding the objective, the steps as JSON and the
+    objective embedding as float32 bytes. Lookups go through an EmbeddingIndex sidecar
+    per reset generation, shared by every process using the store. Its rows follow the
+    playbook ids in ascending order, so row i is the i-th playbook.
+    """
+
+    def __init__(self, path: str, index_path: str | None = None):
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.index_base = os.path.splitext(index_path or path)[0]
+        self.index: EmbeddingIndex | None = None
+        self.generation: int | None = None
+        self.ids: List[int] = []
+        self._migrate()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # one connection per thread, WAL lets readers run alongside a writer
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def add(self, objective: str, steps: list, embedding: Sequence[float], template: dict | None = None) -> int:
+        with self.db as db:
+            cursor = db.execute(
+                "INSERT INTO playbooks (objective, steps, embedding, template, created_at) VALUES (?, ?, ?, ?, ?)",
+                (objective, json.dumps(steps), np.asarray(embedding, dtype=np.float32).tobytes(),
+                 json.dumps(template) if template else None, time.time()))
+        return cursor.lastrowid  # type: ignore
+
+    def get(self, playbook_id: int) -> dict | None:
+        row = self.db.execute(
+            "SELECT id, objective, steps, template FROM playbooks WHERE id = ?", (playbook_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "objective": row[1],
+            "steps": json.loads(row[2]),
+            "template": json.loads(row[3]) if row[3] else None,
+        }
+
+    def nearest(self, embedding: Sequence[float], max_distance: float = 0.5) -> dict | None:
+        with self.lock:
+            ids = self._sync_index()
+            assert self.index is not None
+            rows = self.index.search(embedding, k=1, max_distance=max_distance)
+        return self.get(ids[rows[0]]) if rows else None
+
+    def count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM playbooks").fetchone()[0]
+
+    def reset(self):
+        with self.db as db:
+            generation = db.execute("SELECT generation FROM store_state").fetchone()[0]
+            db.execute("UPDATE store_state SET generation = generation + 1")
+            db.execute("DELETE FROM playbooks")
+        with self.lock, self._index_lock():
+            # other processes move on to the next generation's index on their next lookup
+            EmbeddingIndex(self._index_path(generation)).rebuild([])
+            self.index, self.generation, self.ids = None, None, []
+
+    def import_json(self, record_file: str):
+        """Import playbooks from the old playbook_record.json + playbook_<time>.json files."""
+        with open(record_file, "r") as f:
+            records = json.load(f)
+        rows = []
+        for record in records:
+            if not os.path.exists(record["playbookFile"]):
+                print(f"Skipping playbook with missing file {record['playbookFile']}")
+                continue
+            with open(record["playbookFile"], "r") as f:
+                steps = json.load(f)
+            rows.append((record["objective"], json.dumps(steps),
+                         np.asarray(record["embedding"], dtype=np.float32).tobytes(), time.time()))
+        with self.db as db:
+            db.executemany(
+                "INSERT INTO playbooks (objective, steps, embedding, created_at) VALUES (?, ?, ?, ?)", rows)
+        # keep the old file around, but make sure it is only imported once
+        os.replace(record_file, record_file + ".migrated")
+        print(f"Imported {len(rows)} playbooks from {record_file}")
+
+    def _migrate(self):
+        with self.db as db:
+            # take the write lock first, processes starting together would migrate twice
+            db.execute("BEGIN IMMEDIATE")
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            for migration in migrations[version:]:
+                db.execute(migration)
+            db.execute(f"PRAGMA user_version = {len(migrations)}")
+
+    def _sync_index(self) -> List[int]:
+        # playbooks may have been added or the store reset by another worker or process
+        generation, count = self.db.execute(
+            "SELECT generation, (SELECT COUNT(*) FROM playbooks) FROM store_state").fetchone()
+        if generation != self.generation:
+            self.index = EmbeddingIndex(self._index_path(generation))
+            self.generation, self.ids = generation, []
+        if len(self.ids) == count and len(self.index) == count:
+            return self.ids
+        with self._index_lock():
+            # the file is shared, another process may have added the rows already
+            self.index.reload()
+            ids = [row[0] for row in self.db.execute("SELECT id FROM playbooks ORDER BY id")]
+            last_id = ids[-1] if ids else 0
+            if len(self.index) > len(ids):
+                # playbooks were deleted without a reset
+                self.index.rebuild([self._decode(blob) for (blob,) in self.db.execute(
+                    "SELECT embedding FROM playbooks WHERE id <= ? ORDER BY id", (last_id,))])
+            else:
+                for (blob,) in self.db.execute(
+                        "SELECT embedding FROM playbooks WHERE id <= ? ORDER BY id LIMIT -1 OFFSET ?",
+                        (last_id, len(self.index))).fetchall():
+                    self.index.append(self._decode(blob))
+        self.ids = ids
+        return self.ids
+
+    def _index_path(self, generation: int) -> str:
+        return f"{self.index_base}.{generation}.npy"
+
+    @contextmanager
+    def _index_lock(self):
+        # serializes writes to the index file across processes
+        with open(self.index_base + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _decode(self, blob: bytes) -> np.ndarray:
+        return np.frombuffer(blob, dtype=np.float32)
@@ -0,0 +1,76 @@
+import json
+import re
+from typing import List
+
+# shorter typed values turn up all over an objective, "2" in "set priority 2 on task 12"
+min_slot_length = 2
+placeholder_pattern = re.compile(r"\{\{slot\d+\}\}")
+
+
+def extract_template(objective: str, steps: List[dict]) -> dict | None:
+    """Turn values typed during the recording that come from the objective into slots.
+
+    For "add a task called buy milk" with a step typing "buy milk", the template matches
+    objectives like "add a task called call mom" and types "call mom" instead.
+    """
+    objective = objective.strip()
+    slots: List[tuple[int, str]] = []
+    for step in steps:
+        value = step.get("type")
+        if not isinstance(value, str) or len(value.strip()) < min_slot_length:
+            continue
+        position = find_slot(objective, value)
+        if position is None or any(value == slot for _, slot in slots):
+            continue
+        # overlapping values can not be told apart again
+        if any(position < start + len(slot) and start < position + len(value) for start, slot in slots):
+            continue
+        slots.append((position, value))
+    if not slots:
+        return None
+    slots.sort()
+
+    pattern = ""
+    cursor = 0
+    for index, (position, value) in enumerate(slots):
+        pattern += literal_pattern(objective[cursor:position]) + f"(?P<slot{index}>.+?)"
+        cursor = position + len(value)
+    pattern += literal_pattern(objective[cursor:])
+
+    placeholders = {value: f"{{{{slot{index}}}}}" for index, (_, value) in enumerate(slots)}
+    # only the typed text, selectors and checkpoints stay as they were recorded
+    return {
+        "pattern": pattern,
+        "steps": [{**step, "type": placeholders[step["type"]]} if step.get("type") in placeholders else step
+                  for step in steps],
+    }
+
+
+def fill_template(template: dict, objective: str) -> List[dict] | None:
+    """Return the template steps for the objective, or None if the objective does not fit."""
+    match = re.fullmatch(template["pattern"], objective.strip(), re.IGNORECASE | re.DOTALL)
+    if not match:
+        return None
+    values = {f"{{{{{name}}}}}": value for name, value in match.groupdict().items()}
+    steps = []
+    for step in template["steps"]:
+        # templates saved before slots were limited to the typed text
+        if placeholder_pattern.search(json.dumps({key: item for key, item in step.items() if key != "type"})):
+            return None
+        if isinstance(step.get("type"), str):
+            step = {**step, "type": placeholder_pattern.sub(
+                lambda slot: values.get(slot.group(0), slot.group(0)), step["type"])}
+        steps.append(step)
+    return steps
+
+
+def find_slot(objective: str, value: str) -> int | None:
+    # the typed value has to show up exactly once in the objective, as whole words
+    matches = list(re.finditer(rf"(?<!\w){re.escape(value)}(?!\w)", objective, re.IGNORECASE))
+    return matches[0].start() if len(matches) == 1 else None
+
+
+def literal_pattern(text: str) -> str:
+    # whitespace is the one thing people are sloppy about when retyping an objective
+    return r"\s+".join(re.escape(part) for part in re.split(r"\s+", text.strip()))
+
@@ -0,0 +1,134 @@
+import hashlib
+import os
+import re
+from fnmatch import fnmatchcase
+from typing import Iterable, List
+from urllib.parse import urlsplit
+
+from playwright.sync_api import Error as PlaywrightError
+
+from utils import normalize_text
+
+# how long a recorded selector gets to show up before the step counts as diverged,
+# instead of playwright's 30 second default
+step_timeout = int(os.getenv("REPLAY_STEP_TIMEOUT_MS", "3000"))
+# the share of the recorded hints that must still be on screen for the hint text fallback
+min_hint_overlap = float(os.getenv("REPLAY_MIN_HINT_OVERLAP", "0.5"))
+
+
+class ReplayDivergence(Exception):
+    """The page does not look like it did when the step was recorded."""
+
+
+def url_pattern(url: str) -> str:
+    parts = urlsplit(url)
+    # ids in the path (projects, tasks) change between runs and accounts
+    path = "/".join("*" if re.search(r"\d{3,}", segment) or re.fullmatch(r"[\w-]{16,}", segment) else segment
+                    for segment in parts.path.split("/"))
+    return f"{parts.scheme}://{parts.netloc}{path}"
+
+
+def url_matches(url: str, pattern: str) -> bool:
+    parts = urlsplit(url)
+    return fnmatchcase(f"{parts.scheme}://{parts.netloc}{parts.path}", pattern)
+
+
+def hint_fingerprint(descriptions: Iterable[str]) -> List[str]:
+    return sorted({hashlib.sha1(normalize_text(description).encode("utf-8")).hexdigest()[:8]
+                   for description in descriptions})
+
+
+def hint_overlap(recorded: List[str], current: List[str]) -> float:
+    if not recorded:
+        return 1.0
+    return len(set(recorded) & set(current)) / len(recorded)
+
+
+def record_checkpoint(url: str, hints: dict[str, dict], action: dict) -> dict:
+    """What the page looked like right before `action`: a URL pattern, a fingerprint of the
+    hints on screen and, for clicks, other ways to find the clicked element."""
+    checkpoint = {
+        "url": url_pattern(url),
+        "hints": hint_fingerprint(hint["description"] for hint in hints.values()),
+    }
+    hint = hints.get(action.get("click"))
+    if hint:
+        checkpoint["hint_text"] = hint["description"]
+        checkpoint["locators"] = [f"xpath={hint['xpath']}"]
+        text = re.search(r'text="([^"\n]{1,80})"', hint["description"])
+        if text:
+            checkpoint["locators"].append(f'text="{text.group(1)}"')
+    return checkpoint
+
+
+def check_url(driver, checkpoint: dict):
+    pattern = checkpoint.get("url")
+    if not pattern or url_matches(driver.page.url, pattern):
+        return
+    # the previous step may still be navigating
+    driver.wait_until_ready()
+    if not url_matches(driver.page.url, pattern):
+        raise ReplayDivergence(f"the page is {driver.page.url}, the step was recorded on {pattern}")
+
+
+def find_locator(page, selectors: List[str], timeout: int = step_timeout) -> str | None:
+    # the recorded selector gets time to show up, the alternatives are only checked after it
+    for position, selector in enumerate(dict.fromkeys(selectors)):
+        locator = page.locator(selector)
+        try:
+            if position == 0:
+                locator.wait_for(state="attached", timeout=timeout)
+            if locator.count() == 1:
+                return selector
+        except PlaywrightError:
+            # not there in time, matches more than one element or is not a valid selector
+            continue
+    return None
+
+
+def find_by_hint_text(driver, checkpoint: dict) -> str | None:
+    hint_text = checkpoint.get("hint_text")
+    if not hint_text:
+        return None
+    driver.wait_for_hints()
+    hints = driver.snapshot()
+    driver.hideHints()
+    # the same text on a different screen may well be a different button
+    overlap = hint_overlap(checkpoint.get("hints", []),
+                           hint_fingerprint(hint["description"] for hint in hints.values()))
+    if overlap < min_hint_overlap:
+        return None
+    matches = [hint for hint in hints.values()
+               if normalize_text(hint["description"]) == normalize_text(hint_text)]
+    return f"xpath={matches[0]['xpath']}" if len(matches) == 1 else None
+
+
+def verify_step(driver, checkpoint: dict | None, selector: str | None) -> bool:
+    """The cheap check: the URL and the recorded selector, without any fallback."""
+    try:
+        if checkpoint:
+            check_url(driver, checkpoint)
+    except ReplayDivergence:
+        return False
+    return selector is None or find_locator(driver.page, [selector]) is not None
+
+
+def resolve_step(driver, step: dict) -> dict:
+    """Check the step against the page and return it with a selector that works here.
+
+    Tries the recorded selector, the alternative locators and then the hint with the
+    recorded text. Raises ReplayDivergence when none of them fits.
+    """
+    checkpoint = step.get("checkpoint") or {}
+    if "navigate" in step:
+        return step
+    check_url(driver, checkpoint)
+    if "clicked_element" not in step:
+        return step
+    selector = find_locator(driver.page, [step["clicked_element"], *checkpoint.get("locators", [])]) \
+        or find_by_hint_text(driver, checkpoint)
+    if selector is None:
+        raise ReplayDivergence(f"nothing on the page matches {step['clicked_element']}")
+    if selector != step["clicked_element"]:
+        print(f"The recorded selector {step['clicked_element']} did not match, using {selector}")
+    return {**step, "clicked_element": selector}
@@ -0,0 +1,50 @@
+import base64
+import os
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Literal
+
+from PIL import Image
+
+ScreenshotFormat = Literal["jpeg", "webp", "png"]
+
+screenshot_format: ScreenshotFormat = os.getenv(
+    "SCREENSHOT_FORMAT", "jpeg")  # type: ignore
+screenshot_quality = int(os.getenv("SCREENSHOT_QUALITY", "80"))
+
+
+@dataclass
+class Screenshot:
+    """An already encoded screenshot, ready to be sent to the model as is."""
+    data: bytes
+    format: ScreenshotFormat
+    width: int
+    height: int
+
+    @property
+    def mime_type(self):
+        return f"image/{self.format}"
+
+    def base64(self) -> str:
+        return base64.b64encode(self.data).decode("utf-8")
+
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.base64()}"
+
+    def image(self) -> Image.Image:
+        return Image.open(BytesIO(self.data)).convert("RGB")
+
+    def save(self, path_without_extension: str):
+        path = f"{path_without_extension}.{'jpg' if self.format == 'jpeg' else self.format}"
+        with open(path, "wb") as f:
+            f.write(self.data)
+        return path
+
+    @classmethod
+    def from_image(cls, image: Image.Image, format: ScreenshotFormat = screenshot_format, quality: int = screenshot_quality):
+        buffer = BytesIO()
+        if format == "png":
+            image.save(buffer, format="PNG")
+        else:
+            image.save(buffer, format=format.upper(), quality=quality)
+        return cls(buffer.getvalue(), format, image.width, image.height)
@@ -0,0 +1,57 @@
+import json
+import os
+import time
+
+
+class SessionStore:
+    """The cookies and localStorage of a logged in browser (playwright's storage state) in a JSON file.
+
+    A saved session is considered expired once it is older than `max_age` seconds or all of
+    its persistent cookies expired. Whether it still works is only known by trying it.
+    """
+
+    def __init__(self, path: str, max_age: float):
+        self.path = path
+        self.max_age = max_age
+
+    def load(self) -> dict | None:
+        try:
+            with open(self.path, "r") as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return None if self.expired(state) else state
+
+    def save(self, storage_state: dict) -> dict:
+        state = {**storage_state, "saved_at": time.time()}
+        # written next to the old file and swapped in, so readers never see half a file
+        temp_path = f"{self.path}.tmp"
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.path)
+        return state
+
+    def expired(self, state: dict) -> bool:
+        now = time.time()
+        if now - state.get("saved_at", 0) > self.max_age:
+            return True
+        expiries = [cookie["expires"] for cookie in state.get("cookies", [])
+                    if cookie.get("expires", -1) > 0]
+        return bool(expiries) and max(expiries) < now
+
+
+def local_storage_script(state: dict) -> str:
+    """An init script that puts the saved localStorage items back on the pages of their origin.
+
+    Items the page already has are left alone, so the app's own changes survive reloads.
+    """
+    origins = {origin["origin"]: origin["localStorage"]
+               for origin in state.get("origins", [])}
+    return f'''(() => {{
+    const items = {json.dumps(origins)}[location.origin] || [];
+    for (const {{ name, value }} of items) {{
+        if (localStorage.getItem(name) === null) {{
+            localStorage.setItem(name, value);
+        }}
+    }}
+}})();'''
@@ -0,0 +1,117 @@
+import atexit
+import contextvars
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+from telemetry import span
+
+
+class StepTimings:
+    """Wall-clock time per stage of a step, plus how much of it overlapped other stages."""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.started_at = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            with span(f"step.{name}"):
+                yield
+        finally:
+            self.stages[name] = self.stages.get(
+                name, 0.0) + time.perf_counter() - start
+
+    def wall(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def report(self) -> dict:
+        wall = self.wall()
+        return {
+            "stages": {name: round(seconds, 3) for name, seconds in self.stages.items()},
+            "wall": round(wall, 3),
+            # stages that ran concurrently add up to more than the wall-clock time
+            "overlapped": round(max(0.0, sum(self.stages.values()) - wall), 3),
+        }
+
+
+def summarize_timings(steps: List[dict]) -> dict:
+    stages: Dict[str, float] = {}
+    for step in steps:
+        for name, seconds in step["stages"].items():
+            stages[name] = round(stages.get(name, 0.0) + seconds, 3)
+    return {
+        "steps": len(steps),
+        "stages": stages,
+        "wall": round(sum(step["wall"] for step in steps), 3),
+        "overlapped": round(sum(step["overlapped"] for step in steps), 3),
+    }
+
+
+# CPU bound work (image encoding) that can run while the browser thread talks to chromium,
+# created by the first step that needs it so importing this module starts no threads
+stage_executor: ThreadPoolExecutor | None = None
+stage_executor_lock = threading.Lock()
+
+
+def get_stage_executor() -> ThreadPoolExecutor:
+    global stage_executor
+    with stage_executor_lock:
+        if stage_executor is None:
+            stage_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="vimbot-stage")
+        return stage_executor
+
+
+def run_in_background(timings: StepTimings, name: str, fn: Callable, *args) -> Future:
+    def timed():
+        with timings.stage(name):
+            return fn(*args)
+    # keeps the spans of the stage in the trace of the task that started it
+    return get_stage_executor().submit(contextvars.copy_context().run, timed)
+
+
+class BackgroundWorker:
+    """Runs bookkeeping that the task result does not depend on (like saving playbooks).
+
+    Jobs run one at a time in submission order. Failures are logged, never raised. The
+    thread starts with the first job, call drain() before exiting so none are lost.
+    """
+
+    def __init__(self):
+        self.jobs: queue.Queue[tuple[Callable, tuple]] = queue.Queue()
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+    def defer(self, fn: Callable, *args):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.work, name="vimbot-background", daemon=True)
+                self.thread.start()
+        self.jobs.put((fn, args))
+
+    def drain(self):
+        if self.thread is not None:
+            self.jobs.join()
+
+    def work(self):
+        while True:
+            fn, args = self.jobs.get()
+            try:
+                fn(*args)
+            except Exception:
+                print("Background job failed")
+                traceback.print_exc()
+            finally:
+                self.jobs.task_done()
+
+
+background = BackgroundWorker()
+# a last resort, the entry points drain it themselves before shutting down
+atexit.register(background.drain)
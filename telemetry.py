@@ -0,0 +1,220 @@
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# one <task id>.jsonl file per task with every span of it, off unless set
+trace_dir = os.getenv("TRACE_DIR")
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels, value: float):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(labels)} {value:g}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[Labels, float] = {}
+
+    def set(self, labels: Labels, value: float):
+        self.values[labels] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} gauge"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets=default_buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # per label set: the count in each bucket (the last one is +Inf), the sum and the count
+        self.values: Dict[Labels, Tuple[List[int], float, int]] = {}
+
+    def observe(self, labels: Labels, value: float):
+        counts, total, count = self.values.get(
+            labels, ([0] * (len(self.buckets) + 1), 0.0, 0))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.values[labels] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip([*map(str, self.buckets), "+Inf"], counts):
+                cumulative += bucket_count
+                lines.append(
+                    f"{self.name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total:g}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels) + "}"
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry:
+    """The metrics of the process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Counter | Gauge | Histogram] = {}
+        self.lock = threading.Lock()
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.get_or_create(name, lambda: Counter(name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self.get_or_create(name, lambda: Gauge(name, help))
+
+    def histogram(self, name: str, help: str, buckets=default_buckets) -> Histogram:
+        return self.get_or_create(name, lambda: Histogram(name, help, buckets))
+
+    def get_or_create(self, name, create):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = create()
+            return self.metrics[name]
+
+    def inc(self, name: str, help: str, value: float = 1, **labels):
+        metric = self.counter(name, help)
+        with self.lock:
+            metric.inc(tuple(sorted(labels.items())), value)
+
+    def set(self, name: str, help: str, value: float, **labels):
+        metric = self.gauge(name, help)
+        with self.lock:
+            metric.set(tuple(sorted(labels.items())), value)
+
+    def observe(self, name: str, help: str, value: float, buckets=default_buckets, **labels):
+        metric = self.histogram(name, help, buckets)
+        with self.lock:
+            metric.observe(tuple(sorted(labels.items())), value)
+
+    def render(self) -> str:
+        with self.lock:
+            return "\n".join(line for metric in self.metrics.values() for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+
+class Trace:
+    """Appends the spans of one task to a JSONL file."""
+
+    def __init__(self, path: str):
+        self.file = open(path, "a")
+        self.lock = threading.Lock()
+
+    def write(self, record: dict):
+        with self.lock:
+            # work left running in the background may finish after its task
+            if self.file.closed:
+                return
+            self.file.write(json.dumps(record, default=str) + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+# a context variable instead of a thread local, so work handed to other threads
+# with contextvars.copy_context() ends up in the same trace
+current_trace: contextvars.ContextVar[Trace | None] = contextvars.ContextVar(
+    "current_trace", default=None)
+
+
+@contextmanager
+def trace_task(task_id: str, **attributes):
+    """Collect the spans of a task in TRACE_DIR/<task_id>.jsonl, if TRACE_DIR is set."""
+    if not trace_dir:
+        with span("task", task=task_id, **attributes):
+            yield
+        return
+    os.makedirs(trace_dir, exist_ok=True)
+    trace = Trace(os.path.join(trace_dir, f"{task_id}.jsonl"))
+    token = current_trace.set(trace)
+    try:
+        with span("task", task=task_id, **attributes):
+            yield
+    finally:
+        current_trace.reset(token)
+        trace.close()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block into the vimbot_span_seconds histogram, and the task trace if there is one."""
+    start = time.perf_counter()
+    started_at = time.time()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        registry.observe("vimbot_span_seconds",
+                         "Duration of instrumented operations", duration, span=name)
+        trace = current_trace.get()
+        if trace:
+            trace.write({
+                "span": name,
+                "start": started_at,
+                "duration": duration,
+                "thread": threading.current_thread().name,
+                "error": error,
+                **attributes,
+            })
+
+
+def inc(name: str, help: str, value: float = 1, **labels):
+    registry.inc(name, help, value, **labels)
+
+
+def set_gauge(name: str, help: str, value: float, **labels):
+    registry.set(name, help, value, **labels)
+
+
+def observe(name: str, help: str, value: float, buckets=default_buckets, **labels):
+    registry.observe(name, help, value, buckets, **labels)
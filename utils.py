@@ -1,5 +1,5 @@
 from typing import List
-from scipy import spatial
+
 
 def distances_from_embeddings(
     query_embedding: List[float],
@@ -7,26 +7,36 @@ def distances_from_embeddings(
     distance_metric="cosine",
 ) -> List[float]:
     """Return the distances between a query embedding and a list of embeddings."""
-    distance_metrics = {
-        "cosine": spatial.distance.cosine,
-        "L1": spatial.distance.cityblock,
-        "L2": spatial.distance.euclidean,
-        "Linf": spatial.distance.chebyshev,
-    }
-    distances = [
-        distance_metrics[distance_metric](query_embedding, embedding)
-        for embedding in embeddings
-    ]
-    return distances
+    # numpy is imported on use, so importing normalize_text stays cheap
+    import numpy as np
+
+    if len(embeddings) == 0:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if distance_metric == "cosine":
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+        distances = 1 - (matrix @ query) / norms
+    else:
+        distance_metrics = {
+            "L1": lambda diff: np.abs(diff).sum(axis=1),
+            "L2": lambda diff: np.linalg.norm(diff, axis=1),
+            "Linf": lambda diff: np.abs(diff).max(axis=1),
+        }
+        distances = distance_metrics[distance_metric](matrix - query)
+    return distances.tolist()
 
 
 def indices_of_nearest_neighbors_from_distances(distances: List[float], max_distance: float) -> List[int]:
     """Return a list of indices of nearest neighbors from a list of distances."""
-    # Sort distances and get their indices
-    sorted_indices = sorted(range(len(distances)), key=lambda i: distances[i])
+    import numpy as np
+
+    distances_array = np.asarray(distances)
+    # Filter indices based on max_distance, then sort only what is left
+    filtered_indices = np.flatnonzero(distances_array <= max_distance)
+    return filtered_indices[np.argsort(distances_array[filtered_indices], kind="stable")].tolist()
 
-    # Filter indices based on max_distance
-    filtered_indices = [
-        i for i in sorted_indices if distances[i] <= max_distance]
 
-    return filtered_indices
\ No newline at end of file
+def normalize_text(text: str) -> str:
+    """Collapse whitespace and case, so trivially different objectives compare equal."""
+    return " ".join(text.split()).casefold()